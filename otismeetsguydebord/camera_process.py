@@ -3,7 +3,6 @@ import sys
 import os
 import time
 from queue import Queue
-from collections import defaultdict, deque
 
 import cv2
 import numpy as np
@@ -11,7 +10,9 @@ import numpy as np
 
 from robocam import camera as camera
 from robocam.helpers import multitools as mtools, timers as timers, utilities as utils, colortools as ctools
-from robocam.overlay import screenevents as events, textwriters as writers, assets as assets
+from robocam.overlay import screenevents as events, textwriters as writers, assets as assets, layers as layers
+from robocam.overlay import groups as groups, sprites as sprites
+from robocam.vision import tracking, faces
 
 
 def target(shared, args):
@@ -46,25 +47,38 @@ class SceneManager:
         self.args = args
         self.name = 'otis'
 
-        self.capture = camera.ThreadedCameraPlayer(dim=args.dim, name=self.name).start()
+        if args.decode_threads > 0:
+            model_scale = int(args.cf) if args.reduced_decode is True else None
+            self.capture = camera.ParallelDecodeCameraPlayer(dim=args.dim, name=self.name,
+                                                             decode_threads=args.decode_threads,
+                                                             model_scale=model_scale).start()
+        else:
+            self.capture = camera.ThreadedCameraPlayer(dim=args.dim, name=self.name).start()
         self.event_countdown = events.CountDown(args.dim, name=self.name)
         ### writers for info info writer section
         self.info_writers = []
-        for i in range(3):
+        for i in range(4):
             new_writer = writers.TextWriter((10, -30*(1+i)), ltype=1, scale=.5,
-                                               ref='tl', color='u')
+                                               ref='tl', color='u', cache=sprites.VOLATILE)
             self.info_writers.append(new_writer)
 
         self.info_writers[0].text_fun = lambda mt : f'model compute time = {int(1000 * mt)} ms'
         self.info_writers[1].text_fun = lambda l : f'camera fps = {int(1/l)}'
         self.info_writers[2].text_fun = lambda n: f'{n} face(s) detected'
+        self.info_writers[3].text_fun = lambda g: f'motion = {100 * g[0]:.1f}%, model skipped {int(100 * g[1])}%'
+        #the info text only changes when the model publishes, so it's only drawn then
+        self.hud = layers.OverlayLayer()
+        for writer in self.info_writers:
+            self.hud.add(writer, state=lambda w=writer: w.line)
 
         MA_N = 10
         self.model_time_MA = utils.MovingAverage(MA_N)
         self.latency_MA = utils.MovingAverage(MA_N)
 
         #trackers/queues/etc
-        self.name_tracker = NameTracker()
+        #identity ids are positions in this list, the model uses the same one
+        abs_dir = os.path.dirname(os.path.abspath(__file__))
+        self.identities = faces.IdentityStore(faces.identity_names(os.path.join(abs_dir, 'photo_assets/faces')))
         self.speech_queue = Queue()
         self.joke_script = Queue()
 
@@ -97,15 +111,38 @@ class SceneManager:
     ####################################################################################################################
 
         BBoxes = []
-        self.bbox_coords = np.array(shared.bbox_coords)
+        self.bbox_coords = np.zeros((args.faces, 4), dtype='int64')
+        # local copy of the newest model result
+        self.detections = np.zeros((), dtype=shared.detections.slots.dtype)
+        self.detection_seq = -1
+        # tracks as they're published to everyone else
+        self.track_record = np.zeros((), dtype=shared.tracks.slots.dtype)
 
         for i in range(args.faces):
             box = assets.BoundingBox()
-            box.coords = self.bbox_coords[i, :] # reference a line in teh shared array
+            box.coords = self.bbox_coords[i, :] # one box per track slot
             BBoxes.append(box)
 
         self.BBoxes = BBoxes
-        self.is_updated = True
+
+        #move the boxes with optical flow on a small grey frame in between detections
+        if args.detect_every > 1:
+            scale = args.model_dim[0] / args.dim[0] if args.reduced_decode is True else 1 / args.cf
+            self.tracker = tracking.FlowTracker(scale=scale)
+        else:
+            self.tracker = None
+        #gives each face a stable track id and slot no matter what order the model finds them in
+        self.tracks = tracking.TrackManager(args.faces)
+        #smooths the boxes and predicts where they are at each frame's capture time, one slot per track
+        self.box_filter = tracking.KalmanBoxFilter(args.faces)
+
+        #everything drawn over the camera in the hello scene, back to front
+        self.hello_scene = groups.OverlayGroup()
+        self.box_group = self.hello_scene.add(groups.OverlayGroup())
+        for box in BBoxes:
+            self.box_group.add(box)
+        self.hello_scene.add(self.OTIS.type_line, z=1)
+        self.hello_scene.add(self.hud, z=2)
 
 
     ####################################################################################################################
@@ -124,13 +161,20 @@ class SceneManager:
 
 
     ####################################################################################################################
-    def write_info(self):
-        frame = self.capture.frame
+    def update_info(self):
         mtma = self.model_time_MA.ma
         lat = self.latency_MA.ma
-        n = self.shared.n_faces.value
-        for writer, data in zip(self.info_writers, (mtma, lat, n)):
-            writer.write_fun(frame, data)
+        n = self.detections['n_faces']
+        gate = self.shared.gate
+        for writer, data in zip(self.info_writers, (mtma, lat, n, gate)):
+            writer.line = writer.text_fun(data)
+
+    def tracking_frame(self):
+        if self.args.reduced_decode is True:
+            small = self.capture.small_frame
+        else:
+            small = utils.resize(self.capture.frame, 1 / self.args.cf)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
 
     def hello_fr_loop(self):
         capture = self.capture
@@ -138,46 +182,89 @@ class SceneManager:
         BBoxes = self.BBoxes
         OTIS = self.OTIS
 
-        #get frame
-        capture.read()
-        shared.frame[:]=capture.frame #write to share
-        #cache this stuff to avoid overwrites in the middle
-        #only update
-        if shared.new_overlay.value:
-            old_coords = self.bbox_coords
-            bbox_coords = np.array(shared.bbox_coords)
-            names = np.array(shared.names)
+        #wait for a new frame so overlays are only drawn once per camera frame
+        grabbed, _ = capture.read(block=True, timeout=.5)
+        if grabbed is False:
+            return
+        shared.frames.write(capture.frame, capture.seq, capture.stamp) #write to share
+        if self.args.reduced_decode is True:
+            shared.model_frames.write(capture.small_frame, capture.seq, capture.stamp)
+        tracker = self.tracker
+        if tracker is not None:
+            tracker.push(self.tracking_frame(), capture.seq)
+        #only update when the model has published something new
+        detections = self.detections
+        if shared.detections.seq != self.detection_seq:
+            #copy the whole record at once to avoid overwrites in the middle
+            self.detection_seq, _ = shared.detections.read(detections)
+            n_faces = detections['n_faces']
+            bbox_coords = detections['boxes'][:n_faces]
+            names = detections['ids'][:n_faces]
+            t_frame = detections['t_frame']
 
             self.latency_MA.update(capture.latency)
-            self.model_time_MA.update(shared.m_time.value)
-            #update and hopefully stabilize
-            for i in range(shared.n_faces.value):
-                self.bbox_coords[i] = box_stabilizer(old_coords[i], bbox_coords[i], .1)
-                BBoxes[i].coords = self.bbox_coords[i]
-                BBoxes[i].name = self.name_tracker[names[i]]
-
-            self.is_updated = True
-
-        #write the boxes
-        for i in range(shared.n_faces.value):
-            BBoxes[i].write(capture.frame)
-        #write other stuff
+            self.model_time_MA.update(detections['m_time'])
+            #match the detections to the tracks where the filter thinks the tracks were
+            #when the model's frame was captured
+            tracks = self.tracks
+            slots = tracks.update(bbox_coords, names, detections['scores'][:n_faces],
+                                  track_boxes=self.box_filter.predict(t_frame))
+            self.box_filter.deactivate(tracks.died)
+            #a reused slot still has the old track's filter, start it over at the new track's box.
+            #otherwise if flow loses the new track right away it's drawn and matched where the old one was
+            born = tracks.born
+            self.box_filter.reset(born, tracks.boxes[born], t_frame)
+            placed = slots >= 0
+            #the tracker carries the boxes forward from the frame the model saw,
+            #otherwise the detections go straight to the filter as of when that frame was captured
+            if tracker is not None:
+                tracker.reset(bbox_coords[placed], slots[placed], detections['frame_seq'])
+            else:
+                self.box_filter.update(slots[placed], bbox_coords[placed], t_frame)
+            #one bulk update per model result, unknown people are told apart by track
+            placed_slots = slots[placed]
+            rows = self.identities.update(tracks.ids[placed_slots], tracks.track_ids[placed_slots], t_frame)
+            for slot, row in zip(placed_slots, rows):
+                BBoxes[slot].name = self.identities.name(row)
+
+        #boxes move every frame, identities only change when the model says so
+        if tracker is not None:
+            alive = tracker.alive
+            #the tracker's ids are track slots
+            self.box_filter.update(tracker.ids[alive], tracker.full_boxes[alive], capture.stamp)
+            if tracker.n_lost > 0:
+                shared.detect_now.value = 1
+        #draw the boxes where they should be now, not where the model saw them
+        self.bbox_coords[:] = self.box_filter.predict(capture.stamp)
+        self.publish_tracks()
 
         #update otis's message queue with hellos
-        if self.name_tracker.hello_queue.empty() is False and OTIS.line_complete is True:
-            p, line = self.name_tracker.hello_queue.get()
+        if self.identities.hello_queue.empty() is False and OTIS.line_complete is True:
+            p, line = self.identities.hello_queue.get()
             OTIS.add_lines(line)
             shared.primary.value = p
 
-        ###
-        OTIS.type_line(capture.frame)
-        self.write_info() 
+        #one box per active track slot, then otis and the info on top
+        self.box_group.show(self.tracks.active)
+        self.update_info()
+        self.hello_scene.render(capture.frame)
         capture.show(warn=False, wait=False)
-        #only reset after the data has been updated
-        if shared.new_overlay.value and self.is_updated:
-            shared.new_overlay.value = False
-            self.is_updated = False
-         #next loop won't update
+
+    def publish_tracks(self):
+        tracks = self.tracks
+        record = self.track_record
+        slots = tracks.slots
+        n = len(slots)
+        record['n_faces'] = n
+        record['boxes'][:n] = self.bbox_coords[slots]
+        record['ids'][:n] = tracks.ids[slots]
+        record['track_ids'][:n] = tracks.track_ids[slots]
+        record['scores'][:n] = tracks.scores[slots]
+        record['frame_seq'] = self.capture.seq
+        record['t_frame'] = self.capture.stamp
+        record['m_time'] = self.detections['m_time']
+        record['t_published'] = time.time()
+        self.shared.tracks.write(record, self.capture.seq, self.capture.stamp)
 
     def otis_speaks(self, box=True):
         gls = self.gls
@@ -192,7 +279,10 @@ class SceneManager:
 
     def otis_tells_a_joke_loop(self):
         script = self.joke_script
-        self.capture.read()
+        #the frame is the ring's slot, drawing on it twice would grey the speech box twice
+        grabbed, _ = self.capture.read(block=True, timeout=.5)
+        if grabbed is False:
+            return
 
         mtw = self.otis
         self.otis_speaks()
@@ -233,119 +323,3 @@ _JOKE_SCRIPT = [
            (" It's so freakin' funny cause... you know... like robot overlords and stuff", 2),
            ("I know, I know, I'm a genius, right?", 5)
            ]
-
-
-class NameTracker:
-
-    def __init__(self):
-
-        self._last_seen_timers = []
-        self.known_names = []
-        self.n_known = 0
-        self.loads_names()
-        self.indices_of_observed = []
-        self.unknown_count = 0
-        self.name_for_unknowns = "unknown"
-        self.primary = 0
-        self.hello_queue = Queue()
-
-        #help keep from having random 1 frame bad calls triggering hellos
-        #someone must show up in 5 frames in 1 second to get a hello
-        _bad_hello_function =  lambda : [timers.TimeSinceFirst().start(), 0]
-        self._bad_hello_dict = defaultdict(_bad_hello_function)
-
-    def loads_names(self):
-        # this  might have to change
-        abs_dir = os.path.dirname(os.path.abspath(__file__))
-        face_folder = os.path.join(abs_dir, 'photo_assets/faces')
-        face_files = os.listdir(face_folder)
-
-        for file in face_files:
-            name = ""
-            for char in file:
-                if char.isdigit() or char in ('.', '-'):
-                    break
-                else:
-                    name += char
-
-            #if name isn't new, add it to the list.
-            if name not in self.known_names:
-                self.known_names.append(name)
-                self._last_seen_timers.append(timers.TimeSinceLast())
-             #append name
-             # set timers for each know
-        self.n_known = len(self.known_names)
-
-    def __getitem__(self, i):
-
-        if i < self.n_known:
-            # if it's a new known person
-            if i not in self.indices_of_observed:
-                timer, count = self._bad_hello_dict[i]
-                print(timer(),count)
-
-                ## todo: this should not be hardcoded
-                if timer() <= 1.5 and count > 10:
-                    self.indices_of_observed.append(i)
-                    hello = f'Hello {self.known_names[i]}, welcome!'
-                    self._last_seen_timers[i]() #replace this soon
-                    self.hello_queue.put((i, hello))
-                    #reset timer so it can be used for other things
-                    self._bad_hello_dict[i][0].reset()
-                    self._bad_hello_dict[i][1] = 1
-
-                elif timer() <=1.5:
-                    #count they were seen
-                    self._bad_hello_dict[i][1] += 1
-
-                else:
-                    self._bad_hello_dict[i][0].reset()
-                    self._bad_hello_dict[i][1] = 1
-
-            return self.known_names[i]
-
-        else:
-            name = f'Person {i - self.n_known + 1}'
-            if i not in self.indices_of_observed:
-                #self.indices_of_observed.append(i)
-                #self.unknown_count += 1
-                hello = f'Hello {name}, do we know each other!'
-
-            return ""
-
-
-def box_stabilizer(box0, box1, threshold=.25):
-    """
-    checks that the distance between center points is
-    less than a percentage of the
-    hopefully keeps bboxes from jumping around so much.
-    :param box0: (t, r, b, l)
-    :param box1: (t, r, b, l)
-    :param threshold: float
-    :return: (t, r, b, l)
-    """
-    centers = []
-    radii = []
-    for box in [box0, box1]:
-        t, r, b, l = box
-        c = (r + l) / 2, (t + b) / 2
-        r = np.sqrt((b-t)**2 + (l-r)**2)
-        centers.append(c)
-        radii.append(r)
-
-    distance = utils.linear_distance(*centers)
-    if distance > threshold * radii[0]:
-        return box1
-    else:
-        return box0
-
-
-
-
-
-
-
-
-
-
-
@@ -1,5 +1,5 @@
 import signal
-import sys
+import time
 import logging
 import os
 
@@ -9,6 +9,7 @@ import numpy as np
 from robocam.helpers import multitools as mtools
 from robocam.helpers import timers
 from robocam.helpers import utilities as utils
+from robocam.vision import faces, motion, detectors, boxes as vboxes
 
 DEBUG = False
 if DEBUG:
@@ -34,83 +35,159 @@ def target(shared_data_object, args):
     signal.signal(signal.SIGINT, mtools.close_gracefully)
 
     shared = shared_data_object
-    model = 'cnn' if args.device == 'gpu' else 'hog'
+    if args.detector is None:
+        args.detector = 'cnn' if args.device == 'gpu' else 'hog'
+    detector = detectors.make_detector(args.detector, args.detector_model, args.detector_config)
 
     known_names, known_encodings = load_face_data(face_recognition)
-    face_locator = timers.FunctionTimer(face_recognition.face_locations)
+    abs_dir = os.path.dirname(os.path.abspath(__file__))
+    identities = [name.lower() for name in faces.identity_names(os.path.join(abs_dir, 'photo_assets/faces'))]
+    locate = timers.FunctionTimer(detector.locate)
 
-    # this was probably excessively complicated
-    # counter dict just gives the order of unique names here
-    # so we can have multiple pictures of the same person
-    name_dict = utils.CounterDict()
-    for name in known_names:
-        name_dict[name]
+    # every face in a frame is matched against every known encoding at once
+    gallery = faces.FaceGallery(known_encodings, labels=[identities.index(name.lower()) for name in known_names],
+                                threshold=args.tolerance)
 
     model_timer = timers.TimeSinceLast()
+    # results are built up here then published all at once
+    detections = np.zeros((), dtype=shared.detections.slots.dtype)
+    detections['track_ids'] = -1
+    previous = np.zeros((), dtype=shared.detections.slots.dtype)
+    max_faces = len(detections['ids'])
+    n_passes = 0
+    # skips the model when the room hasn't changed
+    gate = motion.MotionGate(args.motion_gate, args.gate_refresh) if args.motion_gate > 0 else None
+    # identities of faces this worker has already encoded
+    id_cache = faces.IdentityCache(max_age=args.reencode_after)
 
     frame_copy = np.zeros((args.dim[1], args.dim[0], 3), dtype='uint8')
-
+    if args.reduced_decode is True:
+        # the camera already decoded a 1/cf size frame for us
+        model_frame = np.zeros((args.model_dim[1], args.model_dim[0], 3), dtype='uint8')
+    frames = shared.model_frames if args.reduced_decode is True else shared.frames
+
+    # there can be several of these workers. each one claims the newest frame that no
+    # other worker has taken, so whichever worker frees up first gets the next frame
+    seen = -1
     while True:
-        # compress and convert from
+        # sleep until there is a frame no worker has seen
+        if frames.wait_newer(max(seen, frames.claimed), timeout=1) is False:
+            continue
+        seen = frames.seq
+        # when tracking, the camera moves the boxes in between. only detect every
+        # detect_every frames or when the camera asks for it
+        if seen - frames.claimed < args.detect_every and shared.detect_now.value == 0:
+            continue
+        # copy and convert from BGR to RGB in one pass
         model_timer()
-        frame_copy[:,:,:] = np.array(shared.frame)
-        frame_copy = frame_copy[:,:,::-1]
-        compressed_frame = utils.resize(frame_copy, 1/args.cf)
-        observed_boxes = face_locator(compressed_frame, model=model)
-
-        observed_boxes = np.array(observed_boxes) * args.cf
-
-        observed_encodings = face_recognition.face_encodings(frame_copy, observed_boxes)
-        shared.n_faces.value = len(observed_boxes)
-
-        for i in range(shared.n_faces.value):
-
-            np.copyto(shared.bbox_coords[i,:], observed_boxes[i])
-            face_distances = face_recognition.face_distance(known_encodings, observed_encodings[i])
-            best_match_index = np.argmin(face_distances)
-            shared.names[i] = name_dict[known_names[best_match_index]]
-
-        if DEBUG is True:
-            log = '%i'
-            for distance in face_distances:
-                log += (','+str(distance))
-            logging.info(f'log', best_match_index)
-
-        if utils.cv2waitkey() is True:
-            break
+        frame_seq, _ = frames.claim(model_frame if args.reduced_decode is True else frame_copy,
+                                    copy_fn=_to_rgb)
+        # another worker got there first
+        if frame_seq < 0:
+            continue
+        forced = shared.detect_now.value == 1
+        shared.detect_now.value = 0
+        t_frame = frames.stamp
+
+        # faces are found and encoded in source then scaled up to full frame pixels
+        if args.reduced_decode is True:
+            source, source_scale = model_frame, 1 / args.cf
+        else:
+            source, source_scale = frame_copy, 1
+
+        # if nothing moved the last result still stands
+        if gate is not None:
+            run_model = gate(source, force=forced)
+            shared.gate[:] = gate.motion, gate.skip_ratio
+            if run_model is False:
+                continue
+
+        # in between full scans only search around the faces in the last result,
+        # each at about the resolution the detector likes. full scans pick up newcomers
+        n_passes += 1
+        roi_pass = args.full_scan_every > 1 and n_passes % args.full_scan_every != 0
+        if roi_pass is True:
+            shared.detections.read(previous)
+            roi_pass = bool(previous['n_faces'] > 0)
+
+        if roi_pass is True:
+            prior = previous['boxes'][:previous['n_faces']] * source_scale
+            located, pixels = vboxes.locate_in_rois(locate, source, prior)
+        elif args.reduced_decode is True:
+            located = np.array(locate(model_frame)).reshape(-1, 4)
+            pixels = model_frame.shape[0] * model_frame.shape[1]
+        else:
+            compressed_frame = utils.resize(frame_copy, 1/args.cf)
+            located = np.array(locate(compressed_frame)).reshape(-1, 4) * args.cf
+            pixels = compressed_frame.shape[0] * compressed_frame.shape[1]
+
+        located = located[:max_faces]
+        n_faces = len(located)
+        detections['n_faces'] = n_faces
+
+        if n_faces > 0:
+            detections['boxes'][:n_faces] = located / source_scale
+            # faces that were already recognized and haven't changed keep their identity,
+            # only the rest are encoded
+            ids, scores, fresh = id_cache.match(source, located)
+            if not np.all(fresh):
+                observed_encodings = detector.encode(source, located[~fresh])
+                matched, distances = gallery.match(observed_encodings)
+                ids[~fresh] = matched[:, 0]
+                scores[~fresh] = 1 - distances[:, 0]
+            id_cache.update(source, located, ids, scores, fresh)
+            detections['ids'][:n_faces] = ids
+            detections['scores'][:n_faces] = scores
+
+            if DEBUG is True:
+                logging.info(f'ids {ids} scores {scores} reused {fresh} pixels searched {pixels}')
+
+        # publish everything at once so nobody sees new n_faces with old boxes.
+        # if another worker already published a newer frame this result is stale and dropped
+        detections['frame_seq'] = frame_seq
+        detections['t_frame'] = t_frame
+        detections['m_time'] = model_timer()
+        detections['t_published'] = time.time()
+        shared.detections.write_newer(detections, frame_seq)
+
+def _to_rgb(src, dst):
+    cv2.cvtColor(src, cv2.COLOR_BGR2RGB, dst=dst)
 
-        shared.m_time.value = model_timer()
-        shared.new_overlay.value = True # tell other process about new data
-
-    sys.exit()
 
 #this is like this to preserve the local import
-def load_face_data(face_recognition):
+def load_face_data(face_recognition, use_cache=True):
     #this  might have to change
     abs_dir = os.path.dirname(os.path.abspath(__file__))
     face_folder = os.path.join(abs_dir, 'photo_assets/faces')
-    face_files = os.listdir(face_folder)
+    face_files = sorted(os.listdir(face_folder))
+
+    # encodings are cached by photo contents so only new or changed photos are encoded
+    params = f'face_recognition-{getattr(face_recognition, "__version__", "")}-hog-jitters1-small'
+    cache = faces.EncodingCache(os.path.join(abs_dir, 'photo_assets/face_encodings.npz'), params)
+
+    def encode(image_path):
+        image = face_recognition.load_image_file(image_path)
+        encodings = face_recognition.face_encodings(image)
+        return encodings[0] if len(encodings) > 0 else None
 
     names = []
     encodings = []
 
     for file in face_files:
-        name = ""
-        for char in file:
-            if char.isdigit() or char in ('.', '-'):
-                break
-            else:
-                name += char
-
-
+        name = faces.name_from_file(file)
         image_path = os.path.join(face_folder, file)
-        image = face_recognition.load_image_file(image_path)
-        try:
-            encoding = face_recognition.face_encodings(image)[0]
-            encodings.append(encoding)
-            names.append(name.capitalize())
-        except:
+        if use_cache is True:
+            encoding = cache.get(image_path, encode)
+        else:
+            encoding = encode(image_path)
+
+        if encoding is None:
             print("no face was found in", file)
+            continue
+        encodings.append(encoding)
+        names.append(name)
 
-    return names, encodings
+    if use_cache is True:
+        cache.save()
 
+    return names, np.array(encodings, dtype='float32').reshape(-1, cache.dim)
@@ -9,6 +9,7 @@ import argparse
 import numpy as np
 
 import robocam.helpers.multitools as mtools
+from robocam import camera
 from otismeetsguydebord import servo_process
 from otismeetsguydebord import cv_model_process
 from otismeetsguydebord import camera_process
@@ -28,34 +29,79 @@ def make_parser():
                         help='max number of bboxs to render. default =5')
     parser.add_argument('--device', type=str, default='gpu',
                         help='runs a hog if cpu and cnn if gpu')
+    parser.add_argument('--detector', type=str, default=None,
+                        help='face detector: hog, cnn, haar, lbp or dnn. default picks hog or cnn from --device')
+    parser.add_argument('--detector_model', type=str, default=None,
+                        help='cascade xml for haar/lbp or network weights for dnn')
+    parser.add_argument('--detector_config', type=str, default=None,
+                        help='network description for dnn, i.e. deploy.prototxt')
+    parser.add_argument('--tolerance', type=float, default=.6,
+                        help='faces farther than this from everyone known are unknown. default = .6')
     parser.add_argument('--ncpu', type=int, default='1',
-                        help='number of cpus')
+                        help='number of model worker processes. default = 1')
     parser.add_argument('--servo', type=bool, default=False,
                         help='use servos')
     parser.add_argument('-s', '--scale', type=float, default=1)
-    parser.add_argument(-'cv', type=bool, default=False)
+    parser.add_argument('-cv', type=bool, default=False)
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help='decode MJPEG on this many threads. if cf is 2, 4 or 8 the model gets '
+                             'a reduced size frame decoded straight from the jpeg. default = 0')
+    parser.add_argument('--detect_every', type=int, default=1,
+                        help='run the face detector every this many frames and track the faces with '
+                             'optical flow in between. default = 1, no tracking')
+    parser.add_argument('--full_scan_every', type=int, default=1,
+                        help='search the whole frame every this many model passes and only around the '
+                             'last faces found in between. default = 1, always the whole frame')
+    parser.add_argument('--reencode_after', type=float, default=2,
+                        help='a recognized face that hasn\'t moved or changed much is only encoded again '
+                             'after this many seconds. 0 encodes every face every time. default = 2')
+    parser.add_argument('--motion_gate', type=float, default=0,
+                        help='skip the model unless this fraction of a tiny thumbnail changed since the '
+                             'last frame it ran on, i.e. .005. default = 0, never skip')
+    parser.add_argument('--gate_refresh', type=float, default=2,
+                        help='with --motion_gate, run the model at least this often in seconds. default = 2')
+    parser.add_argument('--shm_name', type=str, default=None,
+                        help='put shared data in named shared memory segments so other processes can '
+                             'attach to them by this name. default = None')
+    parser.add_argument('--start_method', type=str, default='fork',
+                        help='multiprocessing start method. spawn and forkserver need --shm_name')
     return parser
 
 
 parser = make_parser()
 args = parser.parse_args()
+if args.start_method != 'fork' and args.shm_name is None:
+    parser.error('--start_method spawn or forkserver needs --shm_name')
 args.video_center = np.array(args.dim)//2
+args.reduced_decode = args.decode_threads > 0 and args.cf in (2, 4, 8)
+args.model_dim = camera.reduced_dim(args.dim, args.cf) if args.reduced_decode else None
 
 
 def main():
+    #the doorbells in the shared data have to come from the context that starts the processes
+    context = multi.get_context(args.start_method)
     #set up shared data
-    shared_data_object = mtools.SharedDataObject()
+    if args.shm_name is None:
+        shared_data_object = mtools.SharedDataObject(context=context)
+    else:
+        shared_data_object = mtools.SharedMemoryObject(args.shm_name, context=context)
     #add shared values
-    shared_data_object.add_value('m_time', 'd', 0.0)
-    shared_data_object.add_value('n_faces', 'i', 0)
     shared_data_object.add_value('primary', 'i', 0)
-    shared_data_object.add_value('new_overlay', ctypes.c_bool, True)
     shared_data_object.add_value('scene', 'i', 0)
+    #set by the camera when it loses track of a face so the model runs right away
+    shared_data_object.add_value('detect_now', 'i', 0)
+    #add shared channels for frames so the model never sees half written frames
+    shared_data_object.add_channel('frames', ctypes.c_uint8, (args.dim[1], args.dim[0], 3)) #dims are backwards cause numpy
+    if args.reduced_decode is True:
+        shared_data_object.add_channel('model_frames', ctypes.c_uint8, (args.model_dim[1], args.model_dim[0], 3))
+    #model results are published as whole records
+    shared_data_object.add_detections('detections', args.faces)
+    #the camera's tracks with stable ids, as of the frame on screen
+    shared_data_object.add_detections('tracks', args.faces)
     #add shared arrays
-    shared_data_object.add_array('frame', ctypes.c_uint8, (args.dim[1], args.dim[0], 3)) #dims are backwards cause numpy
-    shared_data_object.add_array('bbox_coords', ctypes.c_int64, (args.faces, 4))         #is reversed
     shared_data_object.add_array('error', ctypes.c_double, 2)
-    shared_data_object.add_array('names', ctypes.c_uint8, args.faces)
+    #motion gate stats from the model, (motion score, fraction of frames skipped)
+    shared_data_object.add_array('gate', ctypes.c_double, 2)
     #define Processes with shared data
     process_modules = [camera_process, cv_model_process]
     #if servos are true, add it to the process list
@@ -65,15 +111,30 @@ def main():
     processes = []
     #each process module should have a primary function called 'target'
     for module in process_modules:
-        process = multi.Process(target=module.target,
-                                args=(shared_data_object, args))
-        processes.append(process)
-    #start
-    for process in processes:
-        process.start()
-    #join processes
-    for process in processes:
-        process.join()
+        #the model gets a pool of --ncpu workers that share the frames between them
+        n_workers = max(args.ncpu, 1) if module is cv_model_process else 1
+        for _ in range(n_workers):
+            process = context.Process(target=module.target,
+                                      args=(shared_data_object, args))
+            processes.append(process)
+    try:
+        #start
+        for process in processes:
+            process.start()
+        #the camera process ends the show when q is hit, the others run until they're stopped
+        processes[0].join()
+    finally:
+        #runs on q and on ctrl-c, which interrupts the join
+        for process in processes:
+            if process.is_alive() is True:
+                process.terminate()
+        for process in processes:
+            if process.pid is not None:
+                process.join()
+        #remove the shared memory segments
+        if args.shm_name is not None:
+            shared_data_object.close()
+            shared_data_object.unlink()
     #exit on break key
     sys.exit()
 
@@ -1,7 +1,6 @@
 import signal
 import sys
 
-import cv2
 import numpy as np
 
 from robocam.helpers import multitools as mtools, timers as timers
@@ -26,41 +25,55 @@ def target(shared_data_object, args):
     yPID = pid.PIDController(.01, 0, 0)
     update_limiter = timers.CallHzLimiter(1 / 5)
     target = np.array(video_center)
-    last_coords = np.array(shared.bbox_coords[0,:])
-
-    while True:
-        if shared.n_faces.value > 0:
-            break
-
-    while True:
-        #make copies in order to avoid updates in the middle of a loop
-        names = list(np.array(shared.names[:shared.n_faces.value]))
-        primary = shared.primary.value
-
-        if primary in names:
-            p_index = list(names).index(primary)
-        else:
-            p_index = 0
-
-        #copy
-        new_coords = np.array(shared.bbox_coords[p_index,:])
-
-        if update_limiter() and np.all(new_coords != last_coords):
-            t, r, b, l = shared.bbox_coords[p_index,:]
-
-            #if center of the screen, don't adjust the camera
-            if t <= video_center[0] <= b and r <= video_center[0] <= l:
-                error = 0
+    tracks = np.zeros((), dtype=shared.tracks.slots.dtype)
+    last_coords = np.array(tracks['boxes'][0])
+    #the track being followed, it's kept until it ends or the primary person shows up
+    following = -1
+
+    #sleep until somebody shows up
+    seq = -1
+    while tracks['n_faces'] == 0:
+        if shared.tracks.wait_newer(seq, timeout=1) is True:
+            seq, _ = shared.tracks.read(tracks)
+
+    #close_gracefully raises SystemExit, so the serial port is still closed on ctrl+c
+    try:
+        while True:
+            #sleep until the camera publishes something new
+            if shared.tracks.wait_newer(seq, timeout=1) is False:
+                continue
+            #copy the whole record in order to avoid updates in the middle of a loop
+            seq, _ = shared.tracks.read(tracks)
+            n = tracks['n_faces']
+            if n == 0:
+                continue
+            names = list(tracks['ids'][:n])
+            track_ids = list(tracks['track_ids'][:n])
+            primary = shared.primary.value
+
+            if primary in names:
+                p_index = names.index(primary)
+            elif following in track_ids:
+                p_index = track_ids.index(following)
             else:
-                target[0], target[1] = (r+l)//2, (b+t)//2
-                error = target - video_center
-                move_x = xPID.update(error[0], sleep=0)
-                move_y = yPID.update(error[1], sleep=0)
-                Servo.move([-move_x, -move_y])
-
-            last_coords = np.array(new_coords)
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-    Servo.close()
+                p_index = 0
+            following = track_ids[p_index]
+
+            new_coords = np.array(tracks['boxes'][p_index])
+
+            if update_limiter() and np.all(new_coords != last_coords):
+                t, r, b, l = new_coords
+
+                #if center of the screen, don't adjust the camera
+                if t <= video_center[0] <= b and r <= video_center[0] <= l:
+                    error = 0
+                else:
+                    target[0], target[1] = (r+l)//2, (b+t)//2
+                    error = target - video_center
+                    move_x = xPID.update(error[0], sleep=0)
+                    move_y = yPID.update(error[1], sleep=0)
+                    Servo.move([-move_x, -move_y])
+
+                last_coords = np.array(new_coords)
+    finally:
+        Servo.close()
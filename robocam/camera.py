@@ -1,34 +1,42 @@
 #todo: Extend CameraPlayer to work with PiCamera Backend
 #todo: add waitKey() break condition to CamperPlayer Method
 import time
-from threading import Thread
-import platform
+from threading import Thread, Condition, Lock
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 
 import robocam.helpers.timers as timers
 import robocam.overlay.textwriters as writers
+import robocam.sources as sources
 
 class CameraPlayer:
 
     def __init__(self, src=0,
                  name='tracker',
                  dim=None,
-                 max_fps=30,
+                 max_fps=None,
                  **kwargs):
-
-        #do necessary Linux stuff 
-        if platform.system() == 'Linux':
-            self.capture = cv2.VideoCapture(src, cv2.CAP_V4L2)
-            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
-        else:
-            self.capture = cv2.VideoCapture(src)
+        """
+        :param src: a device index, the path to a video file or any sources.CaptureSource
+        :param name: window name
+        :param dim: (width, height). only a device is asked to capture at this size, frames
+        from files and other sources are resized to it by the threaded players
+        :param max_fps: defaults to 30 for a device and to the source's own frame rate otherwise.
+        only a device is asked to capture at this rate
+        """
+        self.capture = sources.make_source(src)
+        # files and CaptureSources that were passed in keep their own size and frame rate
+        device = isinstance(src, (sources.CaptureSource, str)) is False
+        if max_fps is None:
+            max_fps = 30 if device is True else self.capture.get(cv2.CAP_PROP_FPS) or 30
 
         if dim is not None:
             self.dim = dim
-            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, dim[0])
-            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, dim[1])
+            if device is True:
+                self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, dim[0])
+                self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, dim[1])
 
         else:
             self.dim = self.capture.get(cv2.CAP_PROP_FRAME_WIDTH), self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)
@@ -41,7 +49,8 @@ class CameraPlayer:
         self.name = name
         self.stopped = False
         self._max_fps = max_fps
-        self.capture.set(cv2.CAP_PROP_FPS, max_fps)
+        if device is True:
+            self.capture.set(cv2.CAP_PROP_FPS, max_fps)
         self.sleeper = timers.SmartSleeper(1 / self._max_fps)
         self.fps_writer = writers.FPSWriter((10, int(self.dim[1] - 40)))
         self.latency = 0.001
@@ -124,51 +133,458 @@ class CameraPlayer:
         cv2.destroyAllWindows()
         self.stopped = True
 
-#TODO maybe put in a wait until next frame option
+def reduced_dim(dim, scale):
+    """
+    size of a jpeg decoded with IMREAD_REDUCED_*_scale
+    :param dim: (width, height)
+    :param scale: 2, 4 or 8
+    :return: (width, height)
+    """
+    return tuple(-(-int(d) // int(scale)) for d in dim)
+
+
+class FrameRing:
+
+    def __init__(self, shape, n_slots=4, dtype='uint8', small_shape=None):
+        """
+        preallocated ring of frame buffers shared between a capture thread and its readers.
+        the capture thread decodes straight into a free slot and publishes it with a sequence
+        number. readers borrow the newest slot without copying it and release it when they are
+        done. a borrowed slot is never written to until every borrower has released it.
+
+        ring = FrameRing((1080, 1920, 3))
+        i = ring.acquire()
+        capture.read(image=ring.frames[i])
+        ring.publish(i)
+
+        seq, i, frame = ring.borrow()
+        ...
+        ring.release(i)
+
+        :param shape: shape of a single frame i.e. (height, width, 3)
+        :param n_slots: number of slots. needs to be at least 3 so that the writer always has a
+                        free slot while one frame is published and one is borrowed
+        :param dtype: numpy dtype of the frames
+        :param small_shape: if not None, every slot also gets a reduced size frame of this shape
+        """
+        assert n_slots >= 3
+        self.n_slots = n_slots
+        self.frames = np.zeros((n_slots, *shape), dtype=dtype)
+        if small_shape is None:
+            self.small_frames = None
+        else:
+            self.small_frames = np.zeros((n_slots, *small_shape), dtype=dtype)
+        self.seqs = np.full(n_slots, -1, dtype=np.int64)
+        self.stamps = np.zeros(n_slots) # time.time() the frame was captured
+        self.borrows = np.zeros(n_slots, dtype=np.int64)
+        self.writing = np.zeros(n_slots, dtype=bool)
+        self.latest = -1 # slot index of the newest published frame
+        self.seq = -1 # sequence number of the newest published frame
+        self.cond = Condition()
+
+    @property
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def _free_slot(self):
+        # oldest slot that isn't borrowed, being written or the newest frame
+        free = (self.borrows == 0) & ~self.writing
+        if self.latest >= 0:
+            free[self.latest] = False
+        if not free.any():
+            return -1
+        candidates = np.flatnonzero(free)
+        return int(candidates[np.argmin(self.seqs[candidates])])
+
+    def acquire(self, timeout=None):
+        """
+        reserve a slot for writing. blocks until a slot is free
+        :param timeout: seconds to wait. returns -1 on timeout
+        :return: slot index
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self._free_slot() >= 0, timeout)
+            i = self._free_slot()
+            if i >= 0:
+                self.writing[i] = True
+            return i
+
+    def publish(self, i, seq=None, stamp=None):
+        """
+        make slot i the newest frame.
+        :param i: slot index from acquire()
+        :param seq: sequence number. defaults to one more than the last published frame
+        :param stamp: capture time. defaults to now
+        :return: the sequence number
+        """
+        with self.cond:
+            self.seq = self.seq + 1 if seq is None else seq
+            self.seqs[i] = self.seq
+            self.stamps[i] = time.time() if stamp is None else stamp
+            self.writing[i] = False
+            self.latest = i
+            self.cond.notify_all()
+            return self.seq
+
+    def abort(self, i):
+        """
+        give back a slot from acquire() without publishing it
+        """
+        with self.cond:
+            self.writing[i] = False
+            self.cond.notify_all()
+
+    def borrow(self):
+        """
+        borrow the newest frame without copying it. must be given back with release()
+        :return: (seq, slot index, frame) or (-1, -1, None) if nothing has been published
+        """
+        with self.cond:
+            i = self.latest
+            if i < 0:
+                return -1, -1, None
+            self.borrows[i] += 1
+            return int(self.seqs[i]), i, self.frames[i]
+
+    def release(self, i):
+        with self.cond:
+            self.borrows[i] -= 1
+            self.cond.notify_all()
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        block until a frame newer than seq has been published
+        :param seq: sequence number of the last frame consumed
+        :param timeout: seconds to wait
+        :return: True if there is a newer frame, False on timeout
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.seq > seq, timeout)
+
+
+class FrameReader:
+
+    def __init__(self, ring):
+        """
+        a single consumer's cursor into a FrameRing. it holds on to the frame it last
+        borrowed and counts the frames it skipped over (dropped) and the frames it got
+        more than once (duplicated).
+        :param ring: FrameRing
+        """
+        self.ring = ring
+        self.seq = -1
+        self.stamp = 0
+        self.frame = None
+        self.small_frame = None
+        self.is_new = False
+        self.n_read = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self._slot = -1
+
+    def read(self, block=False, timeout=None):
+        """
+        borrow the newest frame and give back the previous one.
+        :param block: if True, wait until there is a frame newer than the last one read
+        :param timeout: seconds to wait when blocking
+        :return: True if frame is a new frame, else False
+        """
+        ring = self.ring
+        if block is True and ring.wait_newer(self.seq, timeout) is False:
+            # keep hold of the old frame rather than borrowing the same one again
+            self.is_new = False
+            return False
+
+        seq, slot, frame = ring.borrow()
+        if self._slot >= 0:
+            ring.release(self._slot)
+        self._slot = slot
+        self.frame = frame
+        if slot >= 0:
+            self.stamp = float(ring.stamps[slot])
+        if ring.small_frames is not None and slot >= 0:
+            self.small_frame = ring.small_frames[slot]
+
+        self.is_new = seq > self.seq
+        if self.is_new is False:
+            self.duplicated += 1
+        elif self.seq >= 0:
+            self.dropped += seq - self.seq - 1
+        self.seq = seq
+        self.n_read += 1
+
+        return self.is_new
+
+    def close(self):
+        if self._slot >= 0:
+            self.ring.release(self._slot)
+        self._slot = -1
+        self.frame = None
+        self.small_frame = None
+
+
 class ThreadedCameraPlayer(CameraPlayer):
 
-    def __init__(self, *args, cache=True, **kwargs):
+    def __init__(self, *args, cache=True, n_slots=4, **kwargs):
         """
         separates the VideoCapture.read() and
         cv2.imshow functions into separate threads.
+
+        the capture thread decodes into a preallocated FrameRing so reading a
+        frame never allocates or copies. if cache is True, read() borrows the newest
+        frame and holds it until the next read() so it is safe to draw on. if cache
+        is False, frame is the newest slot in the ring and can be overwritten by the
+        capture thread at any time.
         :param args:
+        :param cache: bool
+        :param n_slots: number of frame buffers in the ring
         :param kwargs:
         """
         super().__init__(*args, **kwargs)
         self.clock = timers.SmartSleeper()
         self.cache = cache
+        self.ring = self._make_ring(n_slots)
+        self.reader = FrameReader(self.ring)
+        self.seq = -1
         self._frame = None
-        self._c_frame = None
+        self._thread = None
+        self.max_backoff = 1
 
     @property
     def frame(self):
         if self.cache is True:
-            return self._c_frame
+            return self.reader.frame
         else:
             return self._frame
 
+    @property
+    def stamp(self):
+        """
+        time.time() that the current frame was captured
+        """
+        return self.reader.stamp
+
+    @property
+    def small_frame(self):
+        """
+        the reduced size frame that goes with frame, if the player makes them
+        """
+        return self.reader.small_frame
+
+    @property
+    def dropped(self):
+        return self.reader.dropped
+
+    @property
+    def duplicated(self):
+        return self.reader.duplicated
+
+    def _make_ring(self, n_slots):
+        return FrameRing((*self.dim[::-1], 3), n_slots=n_slots)
+
+    def new_reader(self):
+        """
+        make an extra FrameReader on this camera's ring with its own counters
+        """
+        return FrameReader(self.ring)
+
     def start(self):
-        Thread(target=self.update, args=()).start()
+        self._thread = Thread(target=self.update, args=())
+        self._thread.start()
         return self
 
     def update(self):
+        ring = self.ring
+        backoff = 0
 
         while True:
             if self.stopped is True:
                 return
 
+            i = ring.acquire(timeout=.1)
+            if i < 0:
+                continue
+
             tick = time.time()
-            self.grabbed, self._frame = self.capture.read()
-            #self.new_frame = True
+            slot = ring.frames[i]
+            grabbed, frame = self.capture.read(image=slot)
+            if grabbed is True:
+                self._fill(slot, frame)
+
+            self.grabbed = grabbed
+            if grabbed is True:
+                ring.publish(i)
+                backoff = 0
+            else:
+                # back off if the camera stops giving frames instead of spinning
+                ring.abort(i)
+                backoff = min(2 * backoff or .001, self.max_backoff)
+                time.sleep(backoff)
+                continue
+
             self.latency = 1//(time.time() - tick)
 
-    def read(self, Silent=False):
-            #cache the newest frame
-            # if self.new_frame is True and self.cache is True:
-            #     self._c_frame = np.array(self._frame)
-            #     self.new_frame = False
-            self._c_frame = np.array(self._frame)
+    @staticmethod
+    def _fill(slot, frame):
+        # opencv will only decode in place if the slot matches the camera's output
+        if frame is slot:
+            return
+        elif frame.shape == slot.shape:
+            np.copyto(slot, frame)
+        else:
+            cv2.resize(frame, slot.shape[1::-1], dst=slot)
 
-            return self.grabbed, self.frame
+    def read(self, silent=False, block=False, timeout=None):
+        """
+        points frame at the newest frame in the ring without copying it
+        :param silent:
+        :param block: if True, wait until a frame newer than the last one read arrives
+        :param timeout: seconds to wait when blocking. on timeout grabbed is returned as False
+        :return:
+        """
+        ring = self.ring
+        grabbed = self.grabbed
+        if self.cache is True:
+            if self.reader.read(block=block, timeout=timeout) is False and block is True:
+                grabbed = False
+            self.seq = self.reader.seq
+        else:
+            if block is True and ring.wait_newer(self.seq, timeout) is False:
+                grabbed = False
+            i = ring.latest
+            self.seq = int(ring.seqs[i]) if i >= 0 else -1
+            self._frame = ring.frames[i] if i >= 0 else None
+
+        if silent is False:
+            return grabbed, self.frame
+
+    def stop(self):
+        self.stopped = True
+        if self._thread is not None:
+            self._thread.join()
+        self.reader.close()
+        super().stop()
+
+
+class ParallelDecodeCameraPlayer(ThreadedCameraPlayer):
 
+    _REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2,
+                      4: cv2.IMREAD_REDUCED_COLOR_4,
+                      8: cv2.IMREAD_REDUCED_COLOR_8}
 
+    def __init__(self, *args, decode_threads=3, n_slots=None, model_scale=None, **kwargs):
+        """
+        a ThreadedCameraPlayer that splits grabbing and decoding. the capture thread only pulls
+        the compressed MJPEG buffers off the camera and a pool of threads decodes them with
+        cv2.imdecode, which releases the GIL, so several frames are decoded at once. decoded
+        frames are published to the ring in the order they were grabbed.
+
+        if model_scale is 2, 4 or 8, each frame is also decoded at 1/model_scale of its size
+        with jpeg's reduced decoding, which is much cheaper than decoding at full size and
+        shrinking afterwards. the reduced frames are read through small_frame.
+        :param args:
+        :param decode_threads: number of decoding threads
+        :param n_slots: ring size. defaults to enough slots for every decoder plus a reader
+        :param model_scale: None, 2, 4 or 8
+        :param kwargs:
+        """
+        assert model_scale is None or model_scale in self._REDUCED_FLAGS
+        self.model_scale = model_scale
+        n_slots = decode_threads + 3 if n_slots is None else n_slots
+        super().__init__(*args, n_slots=n_slots, **kwargs)
+        self.decode_threads = decode_threads
+        self.pool = None
+        self.decode_time = 0
+        # if the backend can't hand out the MJPEG buffers, retrieve_raw encodes the decoded frames
+        if hasattr(self.capture, 'set_raw'):
+            self.capture.set_raw(True)
+
+        self._next_seq = 0 # next sequence number to be published
+        self._decoded = {} # seq: (slot index, decoded) waiting on earlier frames
+        self._order_lock = Lock()
+
+    def _make_ring(self, n_slots):
+        if self.model_scale is None:
+            return super()._make_ring(n_slots)
+        w, h = reduced_dim(self.dim, self.model_scale)
+        return FrameRing((*self.dim[::-1], 3), n_slots=n_slots, small_shape=(h, w, 3))
+
+    def start(self):
+        self.pool = ThreadPoolExecutor(self.decode_threads)
+        return super().start()
+
+    def update(self):
+        ring = self.ring
+        seq = 0
+        backoff = 0
+
+        while True:
+            if self.stopped is True:
+                return
+
+            tick = time.time()
+            grabbed = self.capture.grab()
+            if grabbed is True:
+                grabbed, buffer = self.capture.retrieve_raw()
+
+            self.grabbed = grabbed
+            if grabbed is False:
+                backoff = min(2 * backoff or .001, self.max_backoff)
+                time.sleep(backoff)
+                continue
+            backoff = 0
+
+            # blocks when every slot is busy, which keeps the number of frames in flight bounded
+            i = -1
+            while i < 0 and self.stopped is False:
+                i = ring.acquire(timeout=.1)
+            if i < 0:
+                return
+
+            self.pool.submit(self._decode, seq, i, buffer, tick)
+            seq += 1
+            self.latency = 1//(time.time() - tick)
+
+    def _decode(self, seq, i, buffer, stamp):
+        # the pool would swallow an exception and seq would never be delivered, which holds
+        # back every frame after it and leaves the capture thread waiting for a slot forever
+        decoded = False
+        try:
+            tick = time.time()
+            frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            decoded = frame is not None
+            if decoded is True:
+                self._fill(self.ring.frames[i], frame)
+
+            if decoded is True and self.model_scale is not None:
+                small_frame = cv2.imdecode(buffer, self._REDUCED_FLAGS[self.model_scale])
+                decoded = small_frame is not None
+                if decoded is True:
+                    self._fill(self.ring.small_frames[i], small_frame)
+            self.decode_time = time.time() - tick
+        except Exception as e:
+            decoded = False
+            print(f'[ERROR] decoding frame {seq} failed: {e!r}')
+        finally:
+            self._deliver(seq, i, decoded, stamp)
+
+    def _deliver(self, seq, i, decoded, stamp):
+        # hold on to frames that finish early until everything grabbed before them is done
+        with self._order_lock:
+            self._decoded[seq] = (i, decoded, stamp)
+            while self._next_seq in self._decoded:
+                i, decoded, stamp = self._decoded.pop(self._next_seq)
+                if decoded is True:
+                    self.ring.publish(i, self._next_seq, stamp)
+                else:
+                    self.ring.abort(i)
+                self._next_seq += 1
+
+    def stop(self):
+        self.stopped = True
+        if self._thread is not None:
+            self._thread.join()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        self.reader.close()
+        CameraPlayer.stop(self)
@@ -55,8 +55,9 @@ def target(shared_data_object, args):
     is_updated = True
 
     while True:
-        #get frame
-        capture.read()
+        #get a new frame, the last one has already been drawn on
+        if capture.read(block=True, timeout=.5)[0] is False:
+            continue
         shared.frame[:]=capture.frame #write to share
         #cache this stuff to avoid overwrites in the middle
         #only update
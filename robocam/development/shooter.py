@@ -75,8 +75,9 @@ def camera_process(shared_data_object):
     crosshair.coords = np.array((*video_center, CROSSHAIR_RADIUS))
 
     while True:
-        #get frame
-        capture.read()
+        #get a new frame, the last one has already been drawn on
+        if capture.read(block=True, timeout=.5)[0] is False:
+            continue
         shared.frame[:]=capture.frame #write to share
         #make bbox
         for i in range(shared.n_faces.value):
@@ -0,0 +1,104 @@
+"""
+benchmark face detector backends on a recorded clip, cpu only
+
+every backend sees the same frames, converted to RGB and shrunk by cf like the model
+process does. reports per frame latency percentiles, frames per second and boxes per second.
+
+PYTHONPATH=. python robocam/examples/detector_benchmark.py -f clip.mp4 --detectors hog,haar
+PYTHONPATH=. python robocam/examples/detector_benchmark.py -f clip.mp4 --detectors dnn \
+    --dnn_model res10_300x300_ssd_iter_140000.caffemodel --dnn_config deploy.prototxt
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import robocam.sources as sources
+from robocam.helpers import utilities as utils
+from robocam.vision import detectors
+
+parser = argparse.ArgumentParser(description='Benchmark face detector backends on a video file')
+parser.add_argument('-f', '--file', type=str, default=None,
+                    help='video to run on. default is a synthetic pattern, which has no faces')
+parser.add_argument('--detectors', type=str, default='hog,haar',
+                    help='comma separated backends from hog, cnn, haar, lbp and dnn. default = hog,haar')
+parser.add_argument('-cf', type=float, default=2,
+                    help='shrink the frame by a factor of cf before detecting. default = 2')
+parser.add_argument('-n', '--n_frames', type=int, default=300, help='max frames per backend. default = 300')
+parser.add_argument('--encode', action='store_true', help='time encoding the faces too')
+parser.add_argument('--cascade', type=str, default=None, help='cascade xml for haar or lbp')
+parser.add_argument('--dnn_model', type=str, default=None, help='network weights for dnn')
+parser.add_argument('--dnn_config', type=str, default=None, help='network description for dnn')
+
+args = parser.parse_args()
+
+
+def load_frames(path=None, n_frames=300, cf=2):
+    """
+    decode the clip once up front so decoding isn't part of the timings
+    :return: list of RGB frames
+    """
+    if path is None:
+        source = sources.SyntheticSource(realtime=False)
+    else:
+        source = sources.VideoFileSource(path, realtime=False)
+
+    frames = []
+    while len(frames) < n_frames:
+        grabbed, frame = source.read()
+        if grabbed is False or frame is None:
+            break
+        if cf != 1:
+            frame = utils.resize(frame, 1 / cf)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    source.release()
+    return frames
+
+
+def run(detector, frames, encode=False):
+    """
+    :return: per frame latencies in seconds, total boxes found
+    """
+    latencies = np.zeros(len(frames))
+    n_boxes = 0
+    for i, frame in enumerate(frames):
+        tick = time.perf_counter()
+        boxes = detector.locate(frame)
+        if encode is True and len(boxes) > 0:
+            detector.encode(frame, boxes)
+        latencies[i] = time.perf_counter() - tick
+        n_boxes += len(boxes)
+    return latencies, n_boxes
+
+
+def report(name, latencies, n_boxes):
+    p50, p90, p99 = 1000 * np.percentile(latencies, (50, 90, 99))
+    total = latencies.sum()
+    print(f'{name:>5}: p50 {p50:7.1f} ms, p90 {p90:7.1f} ms, p99 {p99:7.1f} ms, '
+          f'max {1000 * latencies.max():7.1f} ms, {len(latencies) / total:6.1f} fps, '
+          f'{n_boxes / total:7.1f} boxes/s, {n_boxes / len(latencies):5.2f} boxes/frame')
+
+
+def main(path=None, names=('hog', 'haar'), n_frames=300, cf=2, encode=False):
+    frames = load_frames(path, n_frames, cf)
+    if len(frames) == 0:
+        print('no frames to run on')
+        return
+    h, w = frames[0].shape[:2]
+    print(f'{len(frames)} frames at {w}x{h}')
+
+    for name in names:
+        model_path = args.dnn_model if name == 'dnn' else args.cascade
+        try:
+            detector = detectors.make_detector(name, model_path, args.dnn_config, encode=encode)
+        except (ImportError, AttributeError, FileNotFoundError, ValueError, cv2.error) as e:
+            print(f'{name:>5}: skipped, {e}')
+            continue
+        # the first call can load weights or allocate, don't count it
+        detector.locate(frames[0])
+        report(name, *run(detector, frames, encode))
+
+
+if __name__=='__main__':
+    main(args.file, args.detectors.split(','), args.n_frames, args.cf, args.encode)
@@ -0,0 +1,108 @@
+"""
+benchmark the cost of ThreadedCameraPlayer.read()
+
+compares the old copying read (np.array(frame) every call) against borrowing frames
+from the FrameRing. allocations are measured with tracemalloc, which numpy reports its
+buffers to, so the copying read should show ~1 frame of allocations per read and the
+ring should show ~0 bytes per read in steady state.
+
+with --decode_threads N it instead measures how many 1080p MJPEG frames per second
+ParallelDecodeCameraPlayer delivers with 1 to N decoding threads.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import robocam.camera as camera
+import robocam.sources as sources
+
+parser = argparse.ArgumentParser(description='Benchmark ThreadedCameraPlayer.read()')
+parser.add_argument('-d','--dim',type=tuple, default=(1920, 1080),
+                    help='set video dimensions. default is (1920, 1080)')
+parser.add_argument('-m','--max_fps', type=int, default=30, help='set max fps Default is 30')
+parser.add_argument('-p', '--port', type=int, default=0, help='camera port default is 0')
+parser.add_argument('-f', '--file', type=str, default=None, help='replay a video file instead of the camera')
+parser.add_argument('--synthetic', action='store_true', help='use a synthetic test pattern instead of the camera')
+parser.add_argument('-n', '--n_reads', type=int, default=300, help='number of reads per run')
+parser.add_argument('--decode_threads', type=int, default=0,
+                    help='if > 0, measure MJPEG decode throughput with 1 to decode_threads threads')
+
+args = parser.parse_args()
+
+
+def run(capture, n_reads, copy=False):
+    """
+    reads n_reads frames and returns (bytes allocated per read, ms per read, distinct buffers)
+    """
+    allocated = 0
+    read_time = 0
+    buffers = set()
+
+    for _ in range(n_reads):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        tick = time.perf_counter()
+
+        capture.read()
+        frame = np.array(capture.frame) if copy is True else capture.frame
+
+        read_time += time.perf_counter() - tick
+        allocated += tracemalloc.get_traced_memory()[1] - before
+        buffers.add(frame.__array_interface__['data'][0])
+        time.sleep(1 / capture.max_fps)
+
+    return allocated / n_reads, 1000 * read_time / n_reads, len(buffers)
+
+
+def main(src=0, dim=(1920, 1080), max_fps=30, n_reads=300):
+    capture = camera.ThreadedCameraPlayer(src, dim=dim, max_fps=max_fps).start()
+    while capture.ring.seq < 0:
+        time.sleep(.01)
+
+    tracemalloc.start()
+    for name, copy in (('np.array copy', True), ('ring borrow', False)):
+        # warm up so that one time allocations aren't counted
+        run(capture, 10, copy=copy)
+        per_read, ms, n_buffers = run(capture, n_reads, copy=copy)
+        print(f'{name:>14}: {per_read / 1e6:8.3f} MB allocated/read, '
+              f'{per_read * max_fps / 1e6:8.2f} MB/s at {max_fps} fps, '
+              f'{ms:6.3f} ms/read, {n_buffers} distinct frame buffers')
+    tracemalloc.stop()
+
+    capture.stop()
+
+
+def decode_throughput(src, dim=(1920, 1080), max_threads=4, seconds=5):
+    """
+    frames per second delivered by ParallelDecodeCameraPlayer with 1 to max_threads decoders.
+    src should not be rate limited i.e. SyntheticSource(realtime=False) so decoding is the bottleneck
+    """
+    for n in range(1, max_threads + 1):
+        capture = camera.ParallelDecodeCameraPlayer(src, dim=dim, decode_threads=n).start()
+        reader = capture.new_reader()
+        tick = time.time()
+        first = -1
+        while time.time() - tick < seconds:
+            reader.read(block=True, timeout=1)
+            first = reader.seq if first < 0 else first
+        fps = (reader.seq - first) / (time.time() - tick)
+        print(f'{n} decode thread(s): {fps:6.1f} fps, {reader.dropped} dropped by reader')
+        reader.close()
+        capture.stop()
+
+
+if __name__=='__main__':
+    if args.decode_threads > 0:
+        src = sources.SyntheticSource(args.dim, realtime=False, pattern='noise')
+        decode_throughput(src, args.dim, args.decode_threads)
+        exit()
+
+    if args.synthetic is True:
+        src = sources.SyntheticSource(args.dim, fps=args.max_fps)
+    elif args.file is not None:
+        src = sources.VideoFileSource(args.file, loop=True)
+    else:
+        src = args.port
+    main(src, args.dim, args.max_fps, args.n_reads)
@@ -47,7 +47,9 @@ def main():
     time.sleep(3)
     while True:
 
-        capture.read()
+        #wait for a new frame, greying the same one again makes it darker every pass
+        if capture.read(block=True, timeout=.5)[0] is False:
+            continue
         # frame[:,:,:] = 0
         portion = capture.frame[gls[0]:gls[1], gls[2]:gls[3]]
         ctools.frame_portion_to_grey(portion)
@@ -2,8 +2,13 @@
 tools for using the multiprocessing python package
 """
 
+import os
 import sys
+import time
+import ast
+import json
 import multiprocessing as multi
+from multiprocessing import shared_memory, resource_tracker
 import numpy as np
 import ctypes
 
@@ -26,7 +31,7 @@ class SharedDataObject:
                    'str': ctypes.c_wchar_p,
                    'd': ctypes.c_double}
 
-    def __init__(self):
+    def __init__(self, context=None):
         """
         A container for shared data with multiprocessing.Process's
         DataShare object has no data attributes upon instantiation.
@@ -49,18 +54,40 @@ class SharedDataObject:
         shared_data.value_name.value = 0
         and
         some_parameter = shared_data.value_name.value
+
+        channels hold several copies of an array so one process can publish while
+        others read without locks or torn reads. see SharedChannel
+
+        shared_data.add_channel(channel_name, c_type, dim, n_slots)
+        shared_data.channel_name.write(some_np_array)
+        seq = shared_data.channel_name.read(out=some_np_array)
+
+        every channel has a doorbell so consumers can sleep until something new is published
+        instead of polling
+
+        shared_data.channel_name.wait_newer(seq, timeout)
+
+        doorbells are made from context, which has to be the multiprocessing context that starts
+        the processes they're shared with, i.e. multiprocessing.get_context('spawn').
+        defaults to the multiprocessing module's default context
         """
-        pass
+        self._context = multi if context is None else context
+        self._doorbells = {}
 
     def add_array(self, array_name, c_type, dim):
-        if c_type in self._ctype_hash.keys():
+        if isinstance(c_type, str) and c_type in self._ctype_hash.keys():
             c_type = self._ctype_hash[c_type]
 
-        l = np.product(dim)
+        l = np.prod(dim)
 
-        np_dtype = np.dtype(c_type).name
-        new_array = multi.Array(c_type, int(l)).get_obj()
-        new_array = np.frombuffer(new_array, dtype=np_dtype).reshape(dim)
+        if isinstance(c_type, np.dtype):
+            # numpy dtypes with no ctype, i.e. structured records, get a raw byte buffer
+            new_array = multi.Array(ctypes.c_uint8, int(l) * c_type.itemsize).get_obj()
+            new_array = np.frombuffer(new_array, dtype=c_type).reshape(dim)
+        else:
+            np_dtype = np.dtype(c_type).name
+            new_array = multi.Array(c_type, int(l)).get_obj()
+            new_array = np.frombuffer(new_array, dtype=np_dtype).reshape(dim)
 
         setattr(self, array_name, new_array)
 
@@ -69,6 +96,473 @@ class SharedDataObject:
 
         setattr(self, value_name, new_value)
 
+    def add_channel(self, channel_name, c_type, dim, n_slots=3):
+        """
+        add a SharedChannel of n_slots arrays of shape dim
+        :param channel_name: str
+        :param c_type: ctype, key in _ctype_hash or np.dtype
+        :param dim: shape of a single array i.e. (1080, 1920, 3) for a frame or () for a single record
+        :param n_slots: number of copies. 3 lets the writer keep going while a reader is busy
+        """
+        dim = (dim,) if isinstance(dim, int) else tuple(dim)
+        self.add_array(f'_{channel_name}_slots', c_type, (n_slots, *dim))
+        self.add_array(f'_{channel_name}_state', ctypes.c_int64, SharedChannel.state_size(n_slots))
+        self._doorbells[channel_name] = self._context.Condition()
+        channel = SharedChannel(getattr(self, f'_{channel_name}_slots'),
+                                getattr(self, f'_{channel_name}_state'),
+                                self._doorbells[channel_name])
+
+        setattr(self, channel_name, channel)
+
+    def add_detections(self, channel_name, max_faces, n_slots=3):
+        """
+        add a SharedChannel of detection records (see detection_dtype) so that a whole set
+        of detections is published and read at once
+        """
+        self.add_channel(channel_name, detection_dtype(max_faces), (), n_slots=n_slots)
+
+
+def detection_dtype(max_faces):
+    """
+    a single model result. boxes are (t, r, b, l) in full frame pixels and only
+    the first n_faces rows of boxes, ids, track_ids and scores are filled in.
+    the same record is used for tracks, which also have stable track ids
+    :param max_faces: number of rows
+    :return: np.dtype
+    """
+    return np.dtype([('n_faces', '<i8'),
+                     ('frame_seq', '<i8'), # seq of the frame the model looked at
+                     ('t_frame', '<f8'), # time.time() that frame was captured
+                     ('t_published', '<f8'),
+                     ('m_time', '<f8'), # model compute time in seconds
+                     ('boxes', '<i8', (max_faces, 4)),
+                     ('ids', '<i8', (max_faces,)), # identity ids, -1 if unknown
+                     ('track_ids', '<i8', (max_faces,)), # -1 for raw detections
+                     ('scores', '<f4', (max_faces,))])
+
+class SharedChannel:
+
+    # positions in the state array
+    _LATEST = 0 # slot of the newest published array
+    _SEQ = 1 # sequence number of the newest published array
+    _CLAIMED = 2 # sequence number of the newest array claimed by a worker
+
+    @staticmethod
+    def state_size(n_slots):
+        # latest, seq, claimed, then a generation, a sequence number and a timestamp for every slot
+        return 3 + 3 * n_slots
+
+    def __init__(self, slots, state, doorbell=None):
+        """
+        a single writer, many reader channel of arrays in shared memory.
+
+        the writer always fills a slot other than the newest one, so readers can take
+        the newest array while the next one is being written. each slot has a seqlock
+        generation counter that is odd while the slot is being written. readers check
+        it before and after they copy and try again if it changed, so they never get
+        half of one array and half of another, and neither side ever takes a lock.
+
+        if there is a doorbell, a multiprocessing.Condition, the writer rings it after every
+        write and wait_newer() sleeps on it. without one wait_newer() polls with a backoff.
+
+        only one process should write to a channel with write(). several processes can
+        share it with write_newer(), which takes the doorbell's lock.
+
+        a pool of workers can split the arrays between them with claim(). each array is
+        claimed by at most one worker, and a worker that frees up gets the newest one.
+        claim() and write_newer() need the doorbell's lock, so they raise a RuntimeError on a
+        channel without a doorbell, i.e. one attached with SharedMemoryObject.attach
+        :param slots: shared np.array of shape (n_slots, *dim)
+        :param state: shared int64 np.array of length state_size(n_slots)
+        :param doorbell: multiprocessing.Condition or None
+        """
+        self.slots = slots
+        self.doorbell = doorbell
+        self.state = state
+        self.n_slots = len(slots)
+        n = self.n_slots
+        self.generations = state[3:3 + n]
+        self.seqs = state[3 + n:3 + 2 * n]
+        self.stamps = state[3 + 2 * n:] # nanoseconds
+        self.stamp = 0. # capture time of the array last returned by read() or view()
+
+    @property
+    def seq(self):
+        """
+        sequence number of the newest array. -1 if nothing has been written.
+        cheap enough to poll for new data
+        """
+        return int(self.state[self._SEQ]) - 1
+
+    def begin_write(self):
+        """
+        claim the next slot so it can be written to directly
+        :return: (slot index, view of the slot)
+        """
+        i = (int(self.state[self._LATEST]) + 1) % self.n_slots
+        self.generations[i] += 1 # odd, readers will back off
+        return i, self.slots[i, ...]
+
+    def end_write(self, i, seq=None, stamp=None):
+        """
+        publish slot i from begin_write()
+        :param seq: sequence number to tag the array with. defaults to a running count
+        :param stamp: time.time() the data is from. defaults to now
+        :return: seq
+        """
+        seq = int(self.state[self._SEQ]) if seq is None else seq
+        self.seqs[i] = seq
+        self.stamps[i] = int(1e9 * (time.time() if stamp is None else stamp))
+        self.generations[i] += 1 # even again
+        self.state[self._LATEST] = i
+        self.state[self._SEQ] = seq + 1
+        if self.doorbell is not None:
+            with self.doorbell:
+                self.doorbell.notify_all()
+        return seq
+
+    def wait_newer(self, seq, timeout=None, max_poll=.02):
+        """
+        block until something newer than seq is published
+        :param seq: sequence number of the last array consumed
+        :param timeout: seconds to wait. None waits forever
+        :param max_poll: longest sleep between checks when there is no doorbell
+        :return: True if there is something newer, False on timeout
+        """
+        if self.doorbell is not None:
+            with self.doorbell:
+                return self.doorbell.wait_for(lambda: self.seq > seq, timeout)
+
+        deadline = None if timeout is None else time.time() + timeout
+        sleep = .001
+        while self.seq <= seq:
+            if deadline is not None and time.time() + sleep > deadline:
+                return False
+            time.sleep(sleep)
+            sleep = min(2 * sleep, max_poll)
+        return True
+
+    def write(self, data, seq=None, stamp=None):
+        """
+        copy data into the channel and publish it
+        """
+        i, slot = self.begin_write()
+        np.copyto(slot, data)
+        return self.end_write(i, seq, stamp)
+
+    def _lock(self):
+        if self.doorbell is None:
+            # attached without a doorbell there is nothing to lock with, and without a lock two
+            # processes could both claim the same array or both publish
+            raise RuntimeError('claim() and write_newer() need a channel with a doorbell, '
+                               'start the process from the one that made the shared data')
+        return self.doorbell
+
+    def write_newer(self, data, seq, stamp=None):
+        """
+        write() for channels with several writers. data is only published if seq is newer
+        than what is already there, so results that finish out of order are dropped
+        instead of replacing newer ones
+        :return: True if data was published, False if it was stale
+        """
+        with self._lock():
+            if seq <= self.seq:
+                return False
+            self.write(data, seq, stamp)
+            return True
+
+    def claim(self, out=None, copy_fn=None):
+        """
+        read() for a pool of workers sharing a channel. copies the newest array only if
+        no other worker has claimed it yet
+        :return: (seq, out). seq is -1 if there was nothing unclaimed
+        """
+        with self._lock():
+            seq = self.seq
+            if seq <= self.claimed:
+                return -1, out
+            self.state[self._CLAIMED] = seq + 1
+
+        seq, out = self.read(out, copy_fn)
+        # something newer may have come in while claiming. it's this worker's now too
+        with self._lock():
+            if seq > self.claimed:
+                self.state[self._CLAIMED] = seq + 1
+        return seq, out
+
+    @property
+    def claimed(self):
+        """
+        sequence number of the newest claimed array. -1 if nothing has been claimed
+        """
+        return int(self.state[self._CLAIMED]) - 1
+
+    def view(self):
+        """
+        zero copy access to the newest array. the view is only good as long as
+        check(token) is True afterwards
+        :return: (token, seq, view) or (None, -1, None) if there is nothing to read
+        """
+        while True:
+            i = int(self.state[self._LATEST])
+            generation = int(self.generations[i])
+            if generation == 0:
+                return None, -1, None
+            if generation % 2 == 0:
+                self.stamp = int(self.stamps[i]) / 1e9
+                return (i, generation), int(self.seqs[i]), self.slots[i, ...]
+
+    def check(self, token):
+        """
+        True if the slot behind a view() hasn't been written to since
+        """
+        i, generation = token
+        return int(self.generations[i]) == generation
+
+    def read(self, out=None, copy_fn=None):
+        """
+        consistent copy of the newest array
+        :param out: array to copy into. allocated if None
+        :param copy_fn: copy_fn(src, dst) to use instead of np.copyto, so a conversion
+                        i.e. BGR to RGB can be done in the same pass as the copy
+        :return: (seq, out). seq is -1 if nothing has been written yet
+        """
+        if out is None:
+            out = np.empty(self.slots.shape[1:], dtype=self.slots.dtype)
+
+        while True:
+            token, seq, view = self.view()
+            if token is None:
+                return -1, out
+
+            if copy_fn is None:
+                np.copyto(out, view)
+            else:
+                copy_fn(view, out)
+
+            if self.check(token) is True:
+                return seq, out
+
+
+class SharedValue:
+
+    def __init__(self, array):
+        """
+        stand in for multiprocessing.Value backed by a 1 element array
+        so it can live in a named shared memory segment
+        :param array: np.array of length 1
+        """
+        self._array = array
+
+    @property
+    def value(self):
+        return self._array[0].item()
+
+    @value.setter
+    def value(self, new_value):
+        self._array[0] = new_value
+
+
+class SharedMemoryObject(SharedDataObject):
+
+    SCHEMA_VERSION = 1
+    # header at the front of every segment so it can be attached without knowing its layout
+    _HEADER = np.dtype([('magic', 'S4'),
+                        ('version', '<u4'),
+                        ('ndim', '<u4'),
+                        ('shape', '<i8', 8),
+                        ('name', 'S64'),
+                        ('dtype', 'S1024')]) # np.lib.format descr, so structured dtypes survive
+    _MAGIC = b'RCSM'
+    _DATA_OFFSET = 2048
+    _REGISTRY_SIZE = 2 ** 16
+
+    @classmethod
+    def attach(cls, name):
+        """
+        attach to a SharedMemoryObject made by another process
+        :param name: the name it was created with
+        :return: SharedMemoryObject
+        """
+        return cls(name, create=False)
+
+    def __init__(self, name, create=True, doorbells=None, context=None):
+        """
+        SharedDataObject built on multiprocessing.shared_memory. every array lives in its
+        own named segment ({name}_{array_name}) with a header that describes its dtype and
+        shape, and a registry segment ({name}) lists what has been added. any process can
+        attach by name with SharedMemoryObject.attach(name), so it works with spawn and
+        forkserver, and tools like recorders can attach to a running pipeline.
+
+        the creating process owns the segments and removes them on unlink(), or on exit
+        from a with block. attached processes only close() them.
+
+        with SharedMemoryObject('otis') as shared_data:
+            shared_data.add_array(...)
+            ...
+
+        doorbells can't be put in a named segment, so only processes started from the creating
+        process get them. processes that attach by name poll instead, and can't claim() or write_newer().
+
+        :param name: prefix for the segment names
+        :param create: if False, attach to existing segments
+        :param doorbells: {channel_name: multiprocessing.Condition} handed down by the creator
+        :param context: the multiprocessing context the processes are started with, see SharedDataObject
+        """
+        super().__init__(context=context)
+        if doorbells is not None:
+            self._doorbells = dict(doorbells)
+        self.name = name
+        self.owner = create
+        self._owner_pid = os.getpid()
+        self._segments = {}
+        self._schema = {'arrays': [], 'values': [], 'channels': []}
+
+        if create is True:
+            self._registry = self._open_segment(name, self._REGISTRY_SIZE, create=True)
+            self._write_registry()
+        else:
+            self._registry = self._open_segment(name)
+            self._load_registry()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        if self.owner is True:
+            self.unlink()
+
+    def __getstate__(self):
+        # child processes attach by name rather than inheriting the mappings
+        return {'name': self.name, 'doorbells': self._doorbells}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], create=False, doorbells=state['doorbells'])
+
+    @staticmethod
+    def _open_segment(name, size=0, create=False):
+        segment = shared_memory.SharedMemory(name=name, create=create, size=size)
+        if create is False:
+            # attaching shouldn't let this process's resource tracker unlink the segment when it exits
+            try:
+                resource_tracker.unregister(segment._name, 'shared_memory')
+            except Exception:
+                pass
+        return segment
+
+    def _write_registry(self):
+        schema = json.dumps(self._schema).encode()
+        assert len(schema) + 8 <= self._REGISTRY_SIZE
+        buf = self._registry.buf
+        buf[:8] = np.array([self.SCHEMA_VERSION, len(schema)], dtype='<u4').tobytes()
+        buf[8:8 + len(schema)] = schema
+
+    def _load_registry(self):
+        version, length = np.frombuffer(self._registry.buf[:8], dtype='<u4')
+        if version != self.SCHEMA_VERSION:
+            raise ValueError(f'{self.name} has schema version {version}, expected {self.SCHEMA_VERSION}')
+        self._schema = json.loads(bytes(self._registry.buf[8:8 + length]))
+
+        for array_name in self._schema['arrays']:
+            setattr(self, array_name, self._attach_array(array_name))
+        for value_name in self._schema['values']:
+            setattr(self, value_name, SharedValue(self._attach_array(value_name)))
+        for channel_name in self._schema['channels']:
+            self._make_channel(channel_name)
+
+    def _attach_array(self, array_name):
+        segment = self._open_segment(f'{self.name}_{array_name}')
+        header = np.frombuffer(segment.buf, dtype=self._HEADER, count=1)[0]
+        if header['magic'] != self._MAGIC or header['version'] != self.SCHEMA_VERSION:
+            raise ValueError(f'{segment.name} is not a version {self.SCHEMA_VERSION} robocam segment')
+
+        self._segments[array_name] = segment
+        shape = tuple(header['shape'][:header['ndim']])
+        dtype = np.lib.format.descr_to_dtype(ast.literal_eval(header['dtype'].decode()))
+        return np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=self._DATA_OFFSET)
+
+    def _new_array(self, array_name, dtype, dim):
+        dim = (dim,) if isinstance(dim, (int, np.integer)) else tuple(dim)
+        dtype = np.dtype(dtype)
+        size = self._DATA_OFFSET + int(np.prod(dim)) * dtype.itemsize
+        segment = self._open_segment(f'{self.name}_{array_name}', size, create=True)
+
+        header = np.zeros(1, dtype=self._HEADER)
+        header['magic'] = self._MAGIC
+        header['version'] = self.SCHEMA_VERSION
+        header['ndim'] = len(dim)
+        header['shape'][0, :len(dim)] = dim
+        header['dtype'] = repr(np.lib.format.dtype_to_descr(dtype)).encode()
+        header['name'] = array_name
+        segment.buf[:self._HEADER.itemsize] = header.tobytes()
+
+        self._segments[array_name] = segment
+        new_array = np.ndarray(dim, dtype=dtype, buffer=segment.buf, offset=self._DATA_OFFSET)
+        new_array[...] = 0
+        return new_array
+
+    def add_array(self, array_name, c_type, dim):
+        if isinstance(c_type, str) and c_type in self._ctype_hash.keys():
+            c_type = self._ctype_hash[c_type]
+
+        setattr(self, array_name, self._new_array(array_name, np.dtype(c_type), dim))
+        self._schema['arrays'].append(array_name)
+        self._write_registry()
+
+    def add_value(self, value_name, c_type, value):
+        if isinstance(c_type, str) and c_type in self._ctype_hash.keys():
+            c_type = self._ctype_hash[c_type]
+
+        new_array = self._new_array(value_name, np.dtype(c_type), 1)
+        new_array[0] = value
+        setattr(self, value_name, SharedValue(new_array))
+        self._schema['values'].append(value_name)
+        self._write_registry()
+
+    def add_channel(self, channel_name, c_type, dim, n_slots=3):
+        super().add_channel(channel_name, c_type, dim, n_slots=n_slots)
+        self._schema['channels'].append(channel_name)
+        self._write_registry()
+
+    def _make_channel(self, channel_name):
+        channel = SharedChannel(getattr(self, f'_{channel_name}_slots'),
+                                getattr(self, f'_{channel_name}_state'),
+                                self._doorbells.get(channel_name))
+        setattr(self, channel_name, channel)
+
+    def close(self):
+        """
+        unmap every segment in this process. the SharedMemoryObject can't be used afterwards
+        """
+        schema = self._schema
+        for name in schema['arrays'] + schema['values'] + schema['channels']:
+            self.__dict__.pop(name, None)
+
+        for segment in list(self._segments.values()) + [self._registry]:
+            try:
+                segment.close()
+            except BufferError:
+                # something outside still holds a view. the mapping goes when it does
+                pass
+        self._segments = {}
+
+    def unlink(self):
+        """
+        remove the segments from the system. only the creating process can do this
+        """
+        if self.owner is False or os.getpid() != self._owner_pid:
+            return
+
+        schema = self._schema
+        names = [self.name] + [f'{self.name}_{n}' for n in schema['arrays'] + schema['values']]
+        for name in names:
+            try:
+                shared_memory.SharedMemory(name=name).unlink()
+            except FileNotFoundError:
+                pass
+        self.owner = False
+
 
 class LibraryImportProcess(multi.Process):
 
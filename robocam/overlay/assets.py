@@ -51,15 +51,66 @@ class BoundingBox(base.Writer):
         return np.sqrt((c[0]-point[0])**2 + (c[1]-point[1])**2)
 
 
+    def bounds(self, shape=None, name=None):
+        """
+        (t, r, b, l) box around everything write draws
+        """
+        t, r, b, l = (int(c) for c in self.coords)
+        pad = self.thickness
+        box = [t - pad, r + pad, b + pad, l - pad]
+        if self.show_name is True or name is not None:
+            _name = self.name if name is None else name
+            nt, nr, _, nl = self.name_writer.bounds(shape, text=_name, position=(0, 20), ref=(l, t))
+            box[0], box[1], box[3] = min(box[0], nt), max(box[1], nr), min(box[3], nl)
+        return tuple(box)
+
     def write(self, frame, name=None):
         t, r, b, l = self.coords
         cv2.rectangle(frame, (l, t), (r, b), self.color, self.thickness)
+        self.write_name(frame, name)
 
+    def write_name(self, frame, name=None):
         if self.show_name is True or name is not None:
+            t, r, b, l = self.coords
             _name = self.name if name is None else name
             self.name_writer.write(frame, position=(0, 20), text=_name, ref=(l, t))
             shapes.draw_line(frame,(0,0), (0, 15),self.color, 1,  ref=(l+15, t))
 
+    @classmethod
+    def write_batch(cls, frame, boxes):
+        """
+        write a list of boxes. rectangles that look the same are drawn with one cv2.polylines call.
+        boxes are batched until one overlaps a box already in the batch, so overlapping boxes
+        stack the same way they would if each one was written in turn
+        """
+        if cls.write is not BoundingBox.write:
+            #subclasses that draw something else
+            return super().write_batch(frame, boxes)
+
+        batch = []
+        taken = []
+        for box in boxes:
+            t, r, b, l = box.bounds(frame.shape)
+            if any(t < tb and b > tt and l < tr and r > tl for tt, tr, tb, tl in taken):
+                cls._write_outlines(frame, batch)
+                batch, taken = [], []
+            batch.append(box)
+            taken.append((t, r, b, l))
+        cls._write_outlines(frame, batch)
+
+    @staticmethod
+    def _write_outlines(frame, boxes):
+        # boxes that don't overlap, so it doesn't matter that every name goes on after every rectangle
+        outlines = {}
+        for box in boxes:
+            t, r, b, l = box.coords
+            key = (tuple(box.color), box.thickness)
+            outlines.setdefault(key, []).append(np.array(((l, t), (r, t), (r, b), (l, b)), dtype='int32'))
+        for (color, thickness), polygons in outlines.items():
+            cv2.polylines(frame, polygons, True, color, thickness)
+        for box in boxes:
+            box.write_name(frame)
+
 
 class BoundingCircle(BoundingBox):
 
@@ -91,6 +142,11 @@ class BoundingCircle(BoundingBox):
         else:
             return self.coords[2]
 
+    def bounds(self, shape=None):
+        x, y = self.center
+        radius = self.radius + self.thickness
+        return int(y - radius), int(x + radius + 1), int(y + radius + 1), int(x - radius)
+
     def write(self, frame):
         shapes.draw_circle(frame, self.center, self.radius, self.color, self.thickness)
 
@@ -122,6 +178,12 @@ class CrossHair(BoundingCircle):
         self._radius= new_radius
         self.constant_size = True
 
+    def bounds(self, shape=None):
+        #the cross lines stick out past the circle
+        x, y = self.center
+        reach = 1.1 * self.radius + self.thickness
+        return int(y - reach), int(x + reach + 1), int(y + reach + 1), int(x - reach)
+
     def write(self, frame):
         center = self.center
         radius = self.radius
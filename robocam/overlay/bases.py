@@ -31,6 +31,15 @@ class Writer:
         else:
             self._color = new_color
 
+    @classmethod
+    def write_batch(cls, frame, writers):
+        """
+        write a list of writers of this class one after another. subclasses override this
+        when a lot of them can be drawn at once
+        """
+        for writer in writers:
+            writer.write(frame)
+
     def copy(self, make_list_of =None):
         if make_list_of is None:
             return copy.deepcopy(self)
@@ -0,0 +1,175 @@
+"""
+overlay groups, a scene graph for writers. a group has a position relative to its parent, a z order
+and can be hidden. writers added with anchored=True are moved with it. OverlayGroup.render
+draws the whole tree back to front in one pass, skipping hidden writers and writers that are
+completely off the frame, and writers of the same kind that are drawn one after another are
+handed to their class's write_batch together.
+"""
+from robocam.helpers import utilities as utils
+from robocam.overlay import bases as base
+
+
+class OverlayNode:
+
+    def __init__(self, writer, z=0, anchored=False):
+        """
+        a writer in a group, use OverlayGroup.add to make one
+        :param writer: a Writer, or a function that takes the frame and draws on it
+        :param z: nodes with a bigger z are drawn on top of their siblings
+        :param anchored: if True the writer is moved with the group. its position, worked out
+        against its own ref, is shifted by the group's origin while the group is rendered and put
+        back afterwards. the writer needs a position attribute
+        """
+        self.writer = writer
+        self.draw = writer.write if hasattr(writer, 'write') else writer
+        self.bounds = getattr(writer, 'bounds', None)
+        # writers can be batched, plain functions can't
+        self.kind = type(writer) if isinstance(writer, base.Writer) else None
+        self.z = z
+        self.visible = True
+        self.anchored = anchored
+
+    def _move(self, shape, origin):
+        # the writer's own position and ref are left as they were once the render is done
+        writer = self.writer
+        ref = getattr(writer, 'ref', None)
+        saved = (writer.position, ref)
+        x, y = utils.abs_point(writer.position, ref, shape)
+        writer.position = (x + origin[0], y + origin[1])
+        if hasattr(writer, 'ref'):
+            writer.ref = None
+        return saved
+
+    def _restore(self, saved):
+        self.writer.position = saved[0]
+        if hasattr(self.writer, 'ref'):
+            self.writer.ref = saved[1]
+
+
+class OverlayGroup:
+
+    def __init__(self,
+                 position=(0, 0),
+                 shared_data_object=None,
+                 parser_args=None,
+                 overlay_data_hash=None,
+                 ref=None,
+                 z=0):
+        """
+        a group of writers and other groups that are moved, ordered and hidden together.
+
+        :param position: where the group's origin is relative to ref. if ref is None it's relative
+        to the parent group's origin, and for a group without a parent it's a pixel position
+        :param shared_data_object:
+        :param parser_args:
+        :param overlay_data_hash:
+        :param ref: a point or one of the frame references, i.e. 'c' or 'tl'. see utils.abs_point
+        :param z: groups with a bigger z are drawn on top of their siblings
+
+        subclasses can set up their writers in init, i.e.
+
+        class SystemsInfoWriter(OverlayGroup):
+
+        def __init__(self, position, shared_data_object, parser_args=None, ref=None)
+            super().__init__(position, shared_data_object, parser_args, ref=ref)
+            self.writer1 = self.add(Writer(..., position=pos1, ...))
+            self.writer2 = self.add(Writer(..., position=pos2, ...))
+        """
+        self.shared = shared_data_object
+        self.pargs = parser_args
+        self.ohash = overlay_data_hash
+        self.ref = ref
+        self.position = position
+        self.z = z
+        self.visible = True
+        self.children = []
+        # absolute position of the origin as of the last render
+        self.origin = None
+        self.stats = {}
+
+    def add(self, writer, z=0, anchored=False):
+        """
+        add a writer, a drawing function or another group
+        :return: the OverlayNode, or the group if a group was added
+        """
+        if isinstance(writer, OverlayGroup):
+            if z != 0:
+                writer.z = z
+            self.children.append(writer)
+            return writer
+        node = OverlayNode(writer, z=z, anchored=anchored)
+        self.children.append(node)
+        return node
+
+    def remove(self, child):
+        self.children.remove(child)
+
+    def show(self, visible):
+        """
+        set the visibility of each child in the order they were added, i.e. from a boolean array
+        """
+        for child, v in zip(self.children, visible):
+            child.visible = bool(v)
+
+    def _place(self, shape, parent_origin):
+        if self.ref is not None:
+            self.origin = utils.abs_point(self.position, self.ref, shape)
+        elif parent_origin is not None:
+            self.origin = utils.abs_point(self.position, parent_origin)
+        else:
+            self.origin = utils.abs_point(self.position)
+
+    def _collect(self, shape, parent_origin, drawn, moved, stats):
+        # depth first, back to front. sorted is stable so equal z keeps the order they were added in
+        self._place(shape, parent_origin)
+        h, w = shape[:2]
+        for child in sorted(self.children, key=lambda c: c.z):
+            if child.visible is False:
+                stats['hidden'] += 1
+                continue
+            if isinstance(child, OverlayGroup):
+                child._collect(shape, self.origin, drawn, moved, stats)
+                continue
+            if child.anchored is True:
+                moved.append((child, child._move(shape, self.origin)))
+            if child.bounds is not None:
+                t, r, b, l = child.bounds(shape)
+                if b <= 0 or t >= h or r <= 0 or l >= w:
+                    stats['culled'] += 1
+                    continue
+            drawn.append(child)
+
+    def render(self, frame):
+        """
+        draw everything in the group on frame
+        :return: stats for the pass
+        """
+        stats = {'drawn': 0, 'hidden': 0, 'culled': 0, 'batches': 0}
+        drawn = []
+        moved = []
+        try:
+            self._collect(frame.shape, None, drawn, moved, stats)
+
+            i = 0
+            while i < len(drawn):
+                node = drawn[i]
+                j = i + 1
+                if node.kind is not None:
+                    while j < len(drawn) and drawn[j].kind is node.kind:
+                        j += 1
+                if j - i > 1:
+                    node.kind.write_batch(frame, [n.writer for n in drawn[i:j]])
+                else:
+                    node.draw(frame)
+                stats['batches'] += 1
+                i = j
+        finally:
+            for node, saved in reversed(moved):
+                node._restore(saved)
+
+        stats['drawn'] = len(drawn)
+        self.stats = stats
+        return stats
+
+    def write(self, frame):
+        self.render(frame)
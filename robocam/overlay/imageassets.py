@@ -53,6 +53,15 @@ class ImageAsset(base.Writer):
         img_c = self.center
         return f_center[0] - img_c[1], f_center[1] - img_c[0]
 
+    def bounds(self, shape=None, position=None):
+        """
+        (t, r, b, l) of the image when it's written centered on position
+        """
+        v, h, _ = self.img.shape
+        pos = self.position if position is None else position
+        t, l = self._c_to_tl_on_frame(pos[::-1])
+        return t, l + h, t + v, l
+
     def write(self, frame, position=None, pos_type='c'):
         """
         loc type can either be 'c' for center or 'tl' for top right. must be given in absolute frame
@@ -84,7 +93,8 @@ if __name__=='__main__':
     Pie = ImageAsset('./photo_asset_files/pie_asset')
 
     while True:
-        Capture.read()
+        if Capture.read(block=True, timeout=.5)[0] is False:
+            continue
         frame = Capture.frame
         tick = time.time()
         Pie.write(frame, (860, 540))
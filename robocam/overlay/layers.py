@@ -0,0 +1,220 @@
+"""
+dirty rectangle overlays. most of what gets written on top of the camera only changes a few
+times a second, so an OverlayLayer keeps it drawn on its own canvas and mask. an element is only
+drawn again when its state changes and only the rectangles it covered get repainted. every frame
+the canvas goes onto the camera frame with a masked copy of the rectangles that have something in them.
+"""
+import cv2
+import numpy as np
+
+
+class OverlayElement:
+
+    def __init__(self, writer, state=None, bounds=None, z=0):
+        """
+        something drawn in an OverlayLayer, use OverlayLayer.add to make one
+        :param writer: a Writer, its write(frame) draws the element, or a function that takes the frame
+        :param state: function that returns whatever the drawing depends on, compared with ==.
+        the element is drawn again when it changes. None means it never changes
+        :param bounds: function that takes the frame's shape and returns a (t, r, b, l) box that
+        everything the element draws is inside. defaults to writer.bounds if there is one,
+        otherwise the whole frame is searched for what it drew
+        :param z: elements with a bigger z are drawn on top
+        """
+        self.draw = writer.write if hasattr(writer, 'write') else writer
+        self.state = state
+        self.bounds = bounds if bounds is not None else getattr(writer, 'bounds', None)
+        self.z = z
+        self.visible = True
+        # (t, r, b, l) of what it drew on the layer and the pixels themselves
+        self.rect = None
+        self.patch = None
+        self.mask = None
+        self._drawn = None
+
+    def invalidate(self):
+        """
+        draw it again on the next render even if its state hasn't changed
+        """
+        self._drawn = None
+
+    def _key(self):
+        return self.visible, None if self.state is None else self.state()
+
+
+class OverlayLayer:
+
+    def __init__(self, merge_ratio=2.):
+        """
+        overlays that are drawn once per change instead of once per frame. the canvas is made
+        the size of the first frame rendered onto
+        :param merge_ratio: the occupied rectangles are copied as one box around all of them as long as
+        it isn't more than merge_ratio times their total area, otherwise they're copied one at a time
+        """
+        self.merge_ratio = merge_ratio
+        self.elements = []
+        self.shape = None
+        self.canvas = None
+        self.mask = None
+        self._blank = None
+        self._white = None
+        self._blits = []
+        self.stats = {}
+        self.frames = 0
+        self.redraws = 0
+
+    def add(self, writer, state=None, bounds=None, z=0):
+        """
+        see OverlayElement
+        :return: OverlayElement
+        """
+        element = OverlayElement(writer, state=state, bounds=bounds, z=z)
+        self.elements.append(element)
+        # stable, so equal z keeps the order they were added in
+        self.elements.sort(key=lambda e: e.z)
+        return element
+
+    def remove(self, element):
+        self.elements.remove(element)
+        if element.rect is not None and self.canvas is not None:
+            self._repaint([element.rect])
+            self._plan_blits()
+
+    def _allocate(self, frame):
+        h, w = frame.shape[:2]
+        self.shape = frame.shape
+        self.canvas = np.zeros(frame.shape, dtype=frame.dtype)
+        self.mask = np.zeros((h, w), dtype='uint8')
+        # what elements get drawn on to see what they cover
+        self._blank = np.zeros(frame.shape, dtype=frame.dtype)
+        self._white = np.full(frame.shape, 255, dtype=frame.dtype)
+        for element in self.elements:
+            element.rect = element.patch = element.mask = None
+            element.invalidate()
+
+    def _search_box(self, element):
+        h, w = self.shape[:2]
+        if element.bounds is None:
+            return 0, w, h, 0
+        t, r, b, l = element.bounds(self.shape)
+        return max(int(t), 0), min(int(r), w), min(int(b), h), max(int(l), 0)
+
+    def _draw(self, element):
+        """
+        draw the element on black and on white, anything that's different on one of them is
+        the element. pixels more than half covered are kept. only what's inside the search box
+        is kept, so an element that draws outside of its bounds is clipped to them
+        """
+        element.rect = element.patch = element.mask = None
+        t, r, b, l = self._search_box(element)
+        if b <= t or r <= l:
+            return
+        # the search box is cleared before drawing rather than after. anything an element drew
+        # outside of its own bounds is left on the scratch frames, but it's wiped before any
+        # other element looks there
+        self._blank[t:b, l:r] = 0
+        self._white[t:b, l:r] = 255
+        element.draw(self._blank)
+        element.draw(self._white)
+
+        on_black, on_white = self._blank[t:b, l:r], self._white[t:b, l:r]
+        # how much of the background shows through each pixel
+        through = cv2.subtract(on_white, on_black)
+        if through.ndim == 3:
+            through = through.max(axis=2)
+        covered = through < 128
+
+        rows, cols = np.any(covered, axis=1), np.any(covered, axis=0)
+        if bool(rows.any()) is False:
+            return
+        rt, rb = np.flatnonzero(rows)[[0, -1]]
+        cl, cr = np.flatnonzero(cols)[[0, -1]]
+        crop = np.s_[rt:rb + 1, cl:cr + 1]
+        element.rect = (t + int(rt), l + int(cr) + 1, t + int(rb) + 1, l + int(cl))
+        element.mask = covered[crop].astype('uint8') * 255
+        # the black background darkens anti aliased edges, undo that
+        alpha = 1 - through[crop] / 255.
+        patch = on_black[crop] / np.maximum(alpha, 1 / 255)[(...,) + (None,) * (on_black.ndim - 2)]
+        element.patch = np.clip(np.rint(patch), 0, 255).astype(on_black.dtype)
+
+    def _repaint(self, rects):
+        """
+        redraw the canvas inside rects from the elements' patches, bottom to top
+        :return: number of pixels repainted
+        """
+        pixels = 0
+        for t, r, b, l in rects:
+            self.canvas[t:b, l:r] = 0
+            self.mask[t:b, l:r] = 0
+            pixels += (b - t) * (r - l)
+            for element in self.elements:
+                if element.rect is None or element.visible is False:
+                    continue
+                et, er, eb, el = element.rect
+                it, ir, ib, il = max(t, et), min(r, er), min(b, eb), max(l, el)
+                if ib <= it or ir <= il:
+                    continue
+                src = np.s_[it - et:ib - et, il - el:ir - el]
+                dst = np.s_[it:ib, il:ir]
+                cv2.copyTo(element.patch[src], element.mask[src], self.canvas[dst])
+                np.bitwise_or(self.mask[dst], element.mask[src], out=self.mask[dst])
+        return pixels
+
+    def _plan_blits(self):
+        rects = [e.rect for e in self.elements if e.rect is not None and e.visible is True]
+        if len(rects) == 0:
+            self._blits = []
+            return
+        boxes = np.array(rects)
+        area = ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 1] - boxes[:, 3])).sum()
+        t, r, b, l = boxes[:, 0].min(), boxes[:, 1].max(), boxes[:, 2].max(), boxes[:, 3].min()
+        if (b - t) * (r - l) <= self.merge_ratio * area:
+            self._blits = [(int(t), int(r), int(b), int(l))]
+        else:
+            self._blits = rects
+
+    def render(self, frame):
+        """
+        bring the canvas up to date and put it on the frame
+        """
+        if self.shape != frame.shape:
+            self._allocate(frame)
+
+        dirty = []
+        redrawn = 0
+        for element in self.elements:
+            key = element._key()
+            if key == element._drawn:
+                continue
+            if element.rect is not None:
+                dirty.append(element.rect)
+            if element.visible is True:
+                self._draw(element)
+                redrawn += 1
+                if element.rect is not None:
+                    dirty.append(element.rect)
+            else:
+                element.rect = element.patch = element.mask = None
+            element._drawn = key
+
+        repainted = 0
+        if len(dirty) > 0:
+            repainted = self._repaint(dirty)
+            self._plan_blits()
+
+        composited = 0
+        for t, r, b, l in self._blits:
+            cv2.copyTo(self.canvas[t:b, l:r], self.mask[t:b, l:r], frame[t:b, l:r])
+            composited += (b - t) * (r - l)
+
+        self.frames += 1
+        self.redraws += redrawn
+        self.stats = {'elements': len(self.elements),
+                      'redrawn': redrawn,
+                      'repainted_px': repainted,
+                      'composited_px': composited,
+                      'frame_px': frame.shape[0] * frame.shape[1]}
+        return self.stats
+
+    def write(self, frame):
+        self.render(frame)
@@ -3,6 +3,8 @@ import cv2
 from robocam.helpers import utilities as utis, colortools as ctools
 from robocam.overlay import bases as base
 from robocam.overlay import bases
+from robocam.overlay import sprites
+from robocam.overlay import textmetrics
 
 def draw_circle(frame, center, radius, color='r', thickness=1, ref=None):
 
@@ -101,23 +103,36 @@ def write_text(frame,
                ref=None,
                jtype='l',
                thickness=1,
-               bl=False
+               bl=False,
+               cache=True
                ):
 
         _color = ctools.color_function(color)
         _pos = utis.abs_point(pos, ref, frame.shape)
         _font = cv2.FONT_HERSHEY_DUPLEX if font is None else font
-        _pos = utis.find_justified_start(text, _pos, _font, scale, ltype, jtype)
-
-        cv2.putText(frame,
-                    text,
-                    _pos,
-                    _font,
-                    scale,
-                    _color,
-                    thickness,
-                    ltype,
-                    bl)
+
+        if bl is True or cache is False:
+            _pos = utis.find_justified_start(text, _pos, _font, scale, ltype, jtype)
+            cv2.putText(frame,
+                        text,
+                        _pos,
+                        _font,
+                        scale,
+                        _color,
+                        thickness,
+                        ltype,
+                        bl)
+            return
+
+        #the text is only rasterized the first time, after that it's a masked copy.
+        #cache can also be a sprites.SpriteCache, i.e. sprites.VOLATILE for text that keeps changing
+        _cache = sprites.CACHE if cache is True else cache
+        sprite = _cache.get(text, _font, scale, thickness, ltype)
+        if jtype == 'c':
+            _pos = (int(_pos[0] - sprite.jwidth / 2), _pos[1])
+        elif jtype == 'r':
+            _pos = (int(_pos[0] - sprite.jwidth), _pos[1])
+        sprite.blit(frame, _pos, _color)
 
 def write_bordered_text(frame,
                         text,
@@ -136,9 +151,11 @@ def write_bordered_text(frame,
     _bcolor = ctools.color_function(bcolor)
     _pos = utis.abs_point(pos, ref, frame.shape)
     _font = cv2.FONT_HERSHEY_DUPLEX if font is None else font
-    _pos = utis.find_justified_start(text, _pos, _font, scale, ltype, jtype)
-
-    w, h = cv2.getTextSize(text, _font, scale, ltype)[0]
+    w, h = textmetrics.metrics(_font, scale, ltype).size(text)[0]
+    if jtype == 'c':
+        _pos = (int(_pos[0] - w / 2), _pos[1])
+    elif jtype == 'r':
+        _pos = (int(_pos[0] - w), _pos[1])
 
     l = _pos[0] - border
     r = l + w + 2 * border
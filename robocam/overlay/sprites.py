@@ -0,0 +1,322 @@
+"""
+pre-rasterized text. cv2.putText is slow for big or thick text and most text on the screen
+is the same from frame to frame, so each string is drawn once into a mask and after that
+writing it is a masked copy into the frame.
+"""
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from robocam.overlay import textmetrics
+
+# solid color patches kept per sprite, the least recently used color is dropped after this many
+_MAX_COLORS = 4
+
+
+class Sprite:
+
+    def __init__(self):
+        """
+        a uint8 mask that gets drawn into frames in a solid color. (dx, dy) is where the mask's
+        top left corner goes relative to the point it's drawn at. subclasses fill in the mask
+        """
+        self.mask = np.zeros((0, 0), dtype='uint8')
+        self.dx = self.dy = 0
+        self.binary = True
+        # patches with the frame's channels, one solid patch per color it's drawn in, so a blit
+        # is a single copy, or three opencv calls for anti aliased edges
+        self._solids = OrderedDict()
+        self._weights = self._inv_weights = None
+        self._layout = None
+        # the SpriteCache holding it, which counts the patches' bytes too
+        self._cache = None
+
+    @property
+    def nbytes(self):
+        n = self._full_mask.nbytes + sum(solid.nbytes for solid in self._solids.values())
+        for patch in (self._weights, self._inv_weights):
+            if patch is not None:
+                n += patch.nbytes
+        return n
+
+    @property
+    def _full_mask(self):
+        # the array self.mask is a view of, the patches are made this size
+        return self.mask
+
+    def _check_binary(self, mask):
+        # anti aliased edges need blending, everything else is a straight copy
+        self.binary = bool(np.all((mask == 0) | (mask == 255)))
+
+    def _drop_patches(self):
+        # they're remade at the right size on the next blit
+        self._solids = OrderedDict()
+        self._weights = self._inv_weights = None
+        self._layout = None
+
+    def _patches(self, color, frame):
+        channels = frame.shape[2:]
+        full = self._full_mask
+        shape = (*full.shape, *channels)
+        before = self.nbytes
+        layout = (channels, frame.dtype, full.shape, self.binary)
+        if layout != self._layout:
+            self._drop_patches()
+            if self.binary is False:
+                self._weights = np.empty(shape, dtype=frame.dtype)
+                self._inv_weights = np.empty(shape, dtype=frame.dtype)
+                self._refresh(np.s_[:, :])
+            self._layout = layout
+
+        key = tuple(np.asarray(color).reshape(-1)[:channels[0] if channels else 1])
+        solid = self._solids.get(key)
+        if solid is None:
+            solid = self._solids[key] = np.empty(shape, dtype=frame.dtype)
+            solid[...] = key if channels else key[0]
+            if len(self._solids) > _MAX_COLORS:
+                self._solids.popitem(last=False)
+        else:
+            self._solids.move_to_end(key)
+
+        if self._cache is not None and self.nbytes != before:
+            self._cache._resized(before, self.nbytes)
+        return solid, self._weights, self._inv_weights
+
+    def _refresh(self, region):
+        # keep the blend weights in step after drawing into region of the mask
+        if self._weights is None:
+            return
+        mask = self._full_mask[region]
+        weights = self._weights[region]
+        weights[...] = mask[..., None] if weights.ndim == 3 else mask
+        np.subtract(255, weights, out=self._inv_weights[region])
+
+    def blit(self, frame, pos, color):
+        """
+        draw the mask at pos in color, clipped to the frame
+        """
+        fh, fw = frame.shape[:2]
+        mh, mw = self.mask.shape
+        x, y = pos[0] + self.dx, pos[1] + self.dy
+        l, t = max(x, 0), max(y, 0)
+        r, b = min(x + mw, fw), min(y + mh, fh)
+        if r <= l or b <= t:
+            return
+
+        roi = frame[t:b, l:r]
+        crop = np.s_[t - y:b - y, l - x:r - x]
+        solid, weights, inv_weights = self._patches(color, frame)
+        if self.binary is True:
+            cv2.copyTo(solid[crop], self.mask[crop], roi)
+        else:
+            fg = cv2.multiply(solid[crop], weights[crop], scale=1 / 255)
+            roi[...] = cv2.add(fg, cv2.multiply(roi, inv_weights[crop], scale=1 / 255))
+
+
+class TextSprite(Sprite):
+
+    def __init__(self, text, font, scale, thickness, ltype):
+        """
+        text drawn once into a mask, trimmed to the pixels it covers.
+        (dx, dy) is relative to the point that would be passed to cv2.putText
+        """
+        super().__init__()
+        (w, h), baseline = cv2.getTextSize(text, font, scale, thickness)
+        pad = thickness + 2
+        canvas = np.zeros((h + baseline + 2 * pad, w + 2 * pad), dtype='uint8')
+        cv2.putText(canvas, text, (pad, pad + h), font, scale, 255, thickness, ltype)
+
+        rows, cols = np.any(canvas, axis=1), np.any(canvas, axis=0)
+        if rows.any():
+            t, b = np.flatnonzero(rows)[[0, -1]]
+            l, r = np.flatnonzero(cols)[[0, -1]]
+        else:
+            t = b = l = r = 0
+        self.mask = np.ascontiguousarray(canvas[t:b + 1, l:r + 1])
+        self.dx, self.dy = int(l - pad), int(t - pad - h)
+        self._check_binary(self.mask)
+        # the width utils.find_justified_start would use, ltype goes in as thickness there
+        self.jwidth = cv2.getTextSize(text, font, scale, ltype)[0][0]
+
+
+class TextLayer(Sprite):
+
+    def __init__(self, font, scale, thickness, ltype, line_spacing=None, width=256):
+        """
+        rows of text that grow a few characters at a time, i.e. what a typewriter shows.
+        characters added to the end of the last row are drawn on their own, so keeping
+        the layer up to date costs the same no matter how much text is on it.
+        (dx, dy) is relative to the cv2.putText point of the first row
+        :param line_spacing: pixels between rows. defaults to the height of a line of text
+        :param width: starting width in pixels, the layer grows as needed
+        """
+        super().__init__()
+        self.font = font
+        self.scale = scale
+        self.thickness = thickness
+        self.ltype = ltype
+        self.metrics = textmetrics.metrics(font, scale, thickness)
+        h, baseline = self.metrics.height, self.metrics.baseline
+        self.line_spacing = h + baseline if line_spacing is None else int(line_spacing)
+        self.pad = thickness + 2
+        self.dx, self.dy = -self.pad, -self.pad - h
+        self._canvas = np.zeros((h + baseline + 2 * self.pad, width + 2 * self.pad), dtype='uint8')
+        self.lines = []
+        self._x = []
+        self._extent = (0, 0)
+        self.mask = self._canvas[:0, :0]
+
+    @property
+    def _full_mask(self):
+        return self._canvas
+
+    @property
+    def end(self):
+        """
+        where the next character of the last row goes relative to the first row's cv2.putText point
+        """
+        if len(self.lines) == 0:
+            return 0, 0
+        return int(round(self._x[-1])), (len(self.lines) - 1) * self.line_spacing
+
+    def clear(self):
+        self._canvas[:self._extent[0], :self._extent[1]] = 0
+        self._refresh(np.s_[:self._extent[0], :self._extent[1]])
+        self.binary = True
+        self.lines = []
+        self._x = []
+        self._set_extent(0, 0)
+
+    def update(self, lines):
+        """
+        make the layer show lines, one string per row. text added onto the end of the last
+        row and new rows are drawn on their own, anything else redraws the whole layer
+        """
+        n = len(self.lines)
+        appended = (0 < n <= len(lines)
+                    and all(a == b for a, b in zip(lines[:n - 1], self.lines[:n - 1]))
+                    and lines[n - 1].startswith(self.lines[n - 1]))
+        if appended is False:
+            self.clear()
+            n = 0
+        elif len(lines[n - 1]) > len(self.lines[n - 1]):
+            self._draw(n - 1, lines[n - 1][len(self.lines[n - 1]):])
+            self.lines[n - 1] = lines[n - 1]
+
+        for row in range(n, len(lines)):
+            self.lines.append('')
+            self._x.append(0.)
+            self._draw(row, lines[row])
+            self.lines[row] = lines[row]
+
+    def _draw(self, row, text):
+        if len(text) == 0:
+            return
+        pad, metrics = self.pad, self.metrics
+        x = int(round(self._x[row]))
+        y = row * self.line_spacing
+        advances = metrics.advances(text)
+        right = pad + int(np.ceil(self._x[row] + advances.sum() + metrics.glyph(text[-1])[1])) + pad
+        bottom = y + metrics.height + metrics.baseline + 2 * pad
+        self._reserve(bottom, right)
+
+        cv2.putText(self._canvas, text, (pad + x, pad + metrics.height + y),
+                    self.font, self.scale, 255, self.thickness, self.ltype)
+        self._x[row] += advances.sum()
+
+        # only look at what was just drawn
+        touched = np.s_[y:bottom, max(x, 0):right]
+        if self.binary is True:
+            self._check_binary(self._canvas[touched])
+        self._refresh(touched)
+        self._set_extent(max(self._extent[0], bottom), max(self._extent[1], right))
+
+    def _reserve(self, h, w):
+        ch, cw = self._canvas.shape
+        if h <= ch and w <= cw:
+            return
+        # grow in steps so a line typed a character at a time doesn't copy the canvas every time
+        h = ch if h <= ch else max(h, ch + self.line_spacing)
+        w = cw if w <= cw else max(w, 2 * cw)
+        canvas = np.zeros((h, w), dtype='uint8')
+        canvas[:ch, :cw] = self._canvas
+        self._canvas = canvas
+        self._set_extent(*self._extent)
+        self._drop_patches()
+
+    def _set_extent(self, h, w):
+        self._extent = (h, w)
+        self.mask = self._canvas[:h, :w]
+
+
+class SpriteCache:
+
+    def __init__(self, max_sprites=512, max_bytes=64 * 2**20):
+        """
+        least recently used cache of TextSprites keyed by (text, font, scale, thickness, ltype).
+        the oldest sprites are dropped when there are more than max_sprites or they take
+        up more than max_bytes
+        """
+        self.max_sprites = max_sprites
+        self.max_bytes = max_bytes
+        self._sprites = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def __deepcopy__(self, memo):
+        # writers hold on to a cache, copies of them should share it
+        return self
+
+    @property
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.
+
+    def stats(self):
+        return {'sprites': len(self), 'bytes': self.nbytes, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hit_rate}
+
+    def get(self, text, font, scale, thickness, ltype):
+        key = (text, font, scale, thickness, ltype)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self.hits += 1
+            self._sprites.move_to_end(key)
+            return sprite
+
+        self.misses += 1
+        sprite = TextSprite(text, font, scale, thickness, ltype)
+        self._sprites[key] = sprite
+        sprite._cache = self
+        self.nbytes += sprite.nbytes
+        self._evict()
+        return sprite
+
+    def _resized(self, before, after):
+        # a sprite's patches are made on its first blit and when it's drawn in a new color
+        self.nbytes += after - before
+        self._evict()
+
+    def _evict(self):
+        while len(self._sprites) > 1 and (len(self._sprites) > self.max_sprites or self.nbytes > self.max_bytes):
+            _, old = self._sprites.popitem(last=False)
+            old._cache = None
+            self.nbytes -= old.nbytes
+
+    def clear(self):
+        for sprite in self._sprites.values():
+            sprite._cache = None
+        self._sprites.clear()
+        self.nbytes = 0
+
+
+# shared by every writer in the process
+CACHE = SpriteCache()
+# for text that's different most frames, i.e. counters, so it doesn't push the text that
+# stays on the screen out of CACHE
+VOLATILE = SpriteCache(max_sprites=64, max_bytes=4 * 2**20)
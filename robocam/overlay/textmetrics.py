@@ -0,0 +1,114 @@
+"""
+cached text measurements. opencv's fonts give every glyph a fixed advance, so a string's width
+is the sum of its glyphs' advances plus however far the last glyph sticks out past its
+advance, which is how cv2.getTextSize adds it up. the glyphs are measured once per
+(font, scale, thickness) and after that measuring and wrapping text is arithmetic.
+"""
+import cv2
+import numpy as np
+
+# the advance is measured over this many copies of a glyph so opencv's rounding mostly cancels out
+_REPEATS = 16
+# widths of whole strings are remembered too, up to this many per TextMetrics
+_MAX_WIDTHS = 4096
+
+
+class TextMetrics:
+
+    def __init__(self, font, scale, thickness):
+        """
+        text measurements for one (font, scale, thickness). use metrics() to get a shared one
+        """
+        self.font = font
+        self.scale = scale
+        self.thickness = thickness
+        # char: (advance, overhang) in pixels
+        self._glyphs = {}
+        self._widths = {}
+        # the height and baseline don't depend on the text
+        (_, self.height), self.baseline = cv2.getTextSize('T', font, scale, thickness)
+
+    def glyph(self, char):
+        """
+        :return: (advance, overhang) of a character in pixels
+        """
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            one = cv2.getTextSize(char, self.font, self.scale, self.thickness)[0][0]
+            many = cv2.getTextSize(char * (_REPEATS + 1), self.font, self.scale, self.thickness)[0][0]
+            advance = (many - one) / _REPEATS
+            glyph = self._glyphs[char] = (advance, one - advance)
+        return glyph
+
+    def advances(self, text):
+        """
+        :return: float64 array of each character's advance in pixels
+        """
+        glyph = self.glyph
+        return np.fromiter((glyph(c)[0] for c in text), dtype='float64', count=len(text))
+
+    def width(self, text):
+        width = self._widths.get(text)
+        if width is not None:
+            return width
+        if len(text) == 0:
+            return self.thickness
+        glyph = self.glyph
+        width = int(round(sum(glyph(c)[0] for c in text) + glyph(text[-1])[1]))
+        if len(self._widths) >= _MAX_WIDTHS:
+            self._widths.clear()
+        self._widths[text] = width
+        return width
+
+    def size(self, text):
+        """
+        same as cv2.getTextSize(text, font, scale, thickness)
+        :return: ((width, height), baseline)
+        """
+        return (self.width(text), self.height), self.baseline
+
+    def wrap(self, text, max_width):
+        """
+        split text into lines no wider than max_width, breaking at the last space that fits.
+        a word that's wider than max_width on its own is broken where it runs out of room
+        :return: list of strings
+        """
+        n = len(text)
+        ends = np.zeros(n + 1)
+        np.cumsum(self.advances(text), out=ends[1:])
+        # the widest any glyph sticks out past its advance
+        overhang = max(self.glyph(c)[1] for c in set(text)) if n > 0 else 0
+
+        stubs = []
+        start = 0
+        while True:
+            # the furthest end that still fits
+            end = int(np.searchsorted(ends, ends[start] + max_width - overhang, side='right')) - 1
+            if end >= n:
+                stubs.append(text[start:])
+                return stubs
+
+            split = text.rfind(' ', start, end + 1)
+            if split <= start:
+                split = max(end, start + 1)
+            stubs.append(text[start:split].rstrip(' '))
+
+            start = split
+            while start < n and text[start] == ' ':
+                start += 1
+            if start == n:
+                return stubs
+
+
+_METRICS = {}
+
+
+def metrics(font, scale, thickness):
+    """
+    the shared TextMetrics for (font, scale, thickness)
+    """
+    key = (font, scale, thickness)
+    text_metrics = _METRICS.get(key)
+    if text_metrics is None:
+        text_metrics = _METRICS[key] = TextMetrics(font, scale, thickness)
+    return text_metrics
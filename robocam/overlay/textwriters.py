@@ -10,6 +10,8 @@ import robocam.helpers.timers as timers
 import robocam.helpers.colortools as ctools
 import robocam.overlay.bases as base
 import robocam.overlay.shapes as shapes
+import robocam.overlay.sprites as sprites
+import robocam.overlay.textmetrics as textmetrics
 
 
 class TextWriter(base.Writer):
@@ -24,7 +26,8 @@ class TextWriter(base.Writer):
                  ref=None,
                  text = None,
                  vspace = .5, # % of fheight for vertical space around
-                 jtype = 'l'
+                 jtype = 'l',
+                 cache = True # False, or a sprites.SpriteCache for text that changes every frame
                  ):
 
         self.font = font
@@ -39,6 +42,7 @@ class TextWriter(base.Writer):
         self.vspace = int(self.fheight * vspace)
         self.thickness = thickness
         self.jtype = jtype
+        self.cache = cache
 
     @property
     def line(self):
@@ -56,9 +60,34 @@ class TextWriter(base.Writer):
     # def position(self, new_position):
     #     self._position = uti.abs_point(new_position, self.ref, self.dim)
 
+    @property
+    def metrics(self):
+        # ltype goes in as the thickness to measure the same way utils.find_justified_start does
+        return textmetrics.metrics(self.font, self.scale, self.ltype)
+
     def get_text_size(self, text=None):
         _text = self.line if text is None else text
-        return cv2.getTextSize(_text, self.font, self.scale, self.ltype)
+        return self.metrics.size(_text)
+
+    def bounds(self, shape, text=None, position=None, ref=None):
+        """
+        a (t, r, b, l) box that write draws inside of, with a few pixels to spare
+        :param shape: frame.shape
+        """
+        _text = self.line if text is None else text
+        _position = position if position is not None else self.position
+        _ref = ref if ref is not None else self.ref
+        x, y = utils.abs_point(_position, _ref, shape)
+        if self.jtype == 'c':
+            x -= self.metrics.width(_text) / 2
+        elif self.jtype == 'r':
+            x -= self.metrics.width(_text)
+        drawn = textmetrics.metrics(self.font, self.scale, self.thickness)
+        pad = self.thickness + 4
+        return (int(y - drawn.height - pad),
+                int(x + drawn.width(_text) + pad),
+                int(y + drawn.baseline + pad),
+                int(x - pad))
 
     def add_fun(self, fun):
         self.text_fun = fun
@@ -82,7 +111,8 @@ class TextWriter(base.Writer):
                           thickness=self.thickness,
                           ltype=self.ltype,
                           ref=_ref,
-                          jtype=self.jtype
+                          jtype=self.jtype,
+                          cache=self.cache
                           )
 
     def write_fun(self, frame, *args, **kwargs):
@@ -121,6 +151,7 @@ class TypeWriter(TextWriter):
         self.cursor = Cursor()
         self.script = Queue()
         self.ktimer = timers.CallHzLimiter(self.key_wait)
+        self._layer = None
 
     @property
     def line(self):
@@ -157,6 +188,42 @@ class TypeWriter(TextWriter):
     def is_done(self):
         return self.line_complete and self.script.empty()
 
+    @property
+    def layer(self):
+        if self._layer is None:
+            self._layer = sprites.TextLayer(self.font, self.scale, self.thickness, self.ltype,
+                                            line_spacing=self.fheight + self.vspace)
+        return self._layer
+
+    def write_typed(self, frame, lines, cursor=None, position=None, ref=None):
+        """
+        write lines of typed text one under the other. the text is kept rasterized in
+        self.layer, so only what was typed since the last call gets drawn
+        :param lines: list of strings, the last one is the one being typed
+        :param cursor: character to put after the last line
+        """
+        _position = position if position is not None else self.position
+        _ref = ref if ref is not None else self.ref
+
+        if self.jtype != 'l':
+            #justified text moves while it's typed so it can't be kept
+            v_move = self.fheight + self.vspace
+            [p0, p1] = _position
+            for i, line in enumerate(lines):
+                if cursor is not None and i == len(lines) - 1:
+                    line = line + cursor
+                self.write(frame, line, position=(p0, p1 + i * v_move), ref=_ref)
+            return
+
+        x, y = utils.abs_point(_position, _ref, frame.shape)
+        layer = self.layer
+        layer.update(lines)
+        layer.blit(frame, (x, y), self.color)
+        if cursor is not None:
+            cx, cy = layer.end
+            sprite = sprites.CACHE.get(cursor, self.font, self.scale, self.thickness, self.ltype)
+            sprite.blit(frame, (x + cx, y + cy), self.color)
+
     def add_lines(self, new_lines):
         """
         adds lines to the queue if lines is either a string or
@@ -190,12 +257,12 @@ class TypeWriter(TextWriter):
             if self.ktimer(self.key_wait):
                 self._output += self.line_iter()
 
-            self.write(frame, self._output)
+            self.write_typed(frame, [self._output])
 
         #if the line is done, but the end pause is still going. write whole line with cursor
         elif self.line_iter.is_empty and self.end_timer() is False:
 
-            self.write(frame, self._output + self.cursor())
+            self.write_typed(frame, [self._output], cursor=self.cursor())
 
         #empty line generator and t > pause sets the line to done
         else:
@@ -208,6 +275,8 @@ class TypeWriter(TextWriter):
 class FPSWriter(TextWriter):
 
     def __init__(self, *args, **kwargs):
+        # the count changes most frames, keep it out of the shared sprite cache
+        kwargs.setdefault('cache', sprites.VOLATILE)
         super().__init__(*args, **kwargs)
         self.clock = timers.TimeSinceLast()
         self.clock()
@@ -301,23 +370,7 @@ class MultiTypeWriter(TypeWriter):
         self.end_timer.wait = self.end_pause if pause is None else pause
 
 
-        ts = self.get_text_size(text)[0][0]
-        stubs = []
-
-        while ts > self.llength:
-
-            split_pos = int(self.llength / ts * len(text))
-            split_proposal = text[:split_pos + 1]
-            #break at last space in the shortened line
-            for i in range(split_pos+1):
-                if split_proposal[-1-i] == ' ':
-                    break
-
-            stubs.append(split_proposal[:split_pos-i])
-            text = text[split_pos - i:].strip(' ')
-            ts = self.get_text_size(text)[0][0]
-
-        stubs.append(text)
+        stubs = self.metrics.wrap(text, self.llength)
 
         #set first stub
         self._stub = stubs[0]
@@ -335,20 +388,13 @@ class MultiTypeWriter(TypeWriter):
         self._output = ''
 
     def type_line(self, frame):
-        v_move = self.fheight + self.vspace
-        n_fin = len(self._used_stubs)
-        [p0, p1] = self.position
-
         #do nothing if the line is complete
         if self.line_complete is True:
             return
 
         if self._stub_complete is False:
-            #print finished lines as static
-            for i in range(n_fin):
-                self.write(frame, self._used_stubs[i], position=(p0, p1 + i * v_move))
-            #then type out current line
-            self._type_stub(frame, position=(p0, p1 + n_fin * v_move))
+            #finished lines are static, then type out current line
+            self._type_stub(frame)
             return
 
         #refill and keep going
@@ -357,25 +403,19 @@ class MultiTypeWriter(TypeWriter):
 
         else:#same as above but the first check of the tiemr will start it.
             if self.end_timer() is False:
-                for i in range(n_fin):
-                    self.write(frame, self._used_stubs[i], position=(p0, p1 + i * v_move))
-                self._type_stub(frame, position=(p0, p1 + (n_fin) * v_move))
+                self._type_stub(frame)
             else:
                 self.line_complete = True
 
     def _type_stub(self, frame, position=None, ref=None):
         """
-        single line stochastic typer just to clean things up.
+        single line stochastic typer just to clean things up. the finished stubs are
+        written above the one being typed
         :param frame:
-        :param position:
+        :param position: position of the first line
         :param ref:
         :return:
         """
-        if position is None:
-            _position = self.position
-        else:
-            _position = utils.abs_point(position, ref, frame.shape)
-
         if self._stub_iter.is_empty is False:
             #pause for a comma a tad
             if len(self._output) > 0 and self._output[-1] == ',':
@@ -386,13 +426,15 @@ class MultiTypeWriter(TypeWriter):
             if self.ktimer(cpf*self.key_wait):
                 self._output += self._stub_iter()
 
-            self.write(frame, self._output, position=_position)
+            self.write_typed(frame, self._used_stubs + [self._output], position=position, ref=ref)
 
         #if the line is done, but the end pause is still going. write whole line with cursor
         else:
-            self.write(frame,
-                       text=self._output + self.cursor(),
-                       position=_position)
+            self.write_typed(frame,
+                             self._used_stubs + [self._output],
+                             cursor=self.cursor(),
+                             position=position,
+                             ref=ref)
 
             self._stub_complete = True
 
@@ -0,0 +1,294 @@
+"""
+capture sources for CameraPlayer. each one has the same read/grab/retrieve/get/set/release
+interface as cv2.VideoCapture so the players don't need to know where frames come from.
+a webcam, a recorded video or a synthetic pattern can be swapped in for each other, which
+makes it possible to test and benchmark pipelines on machines without a camera.
+"""
+import abc
+import time
+import platform
+
+import cv2
+import numpy as np
+
+
+class CaptureSource(abc.ABC):
+
+    @abc.abstractmethod
+    def __init__(self, *args, **kwargs):
+        """
+        abstract base class for capture sources. subclasses need to
+        implement grab and retrieve. read is grab followed by retrieve
+        """
+        pass
+
+    @abc.abstractmethod
+    def grab(self):
+        """
+        advance to the next frame
+        :return: True if there is a frame
+        """
+        return True
+
+    @abc.abstractmethod
+    def retrieve(self, image=None):
+        """
+        decode the grabbed frame. if image is a buffer of the right shape the
+        frame is decoded into it
+        :return: (retval, image)
+        """
+        return False, None
+
+    def read(self, image=None):
+        if self.grab() is False:
+            return False, None
+        return self.retrieve(image=image)
+
+    def retrieve_raw(self):
+        """
+        the grabbed frame as compressed jpeg bytes so it can be decoded somewhere else.
+        sources that can't hand out their compressed frames encode them here
+        :return: (retval, 1d uint8 array)
+        """
+        grabbed, image = self.retrieve()
+        if grabbed is False:
+            return False, None
+        return cv2.imencode('.jpg', image)
+
+    def get(self, prop):
+        return 0
+
+    def set(self, prop, value):
+        return False
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class V4L2Source(CaptureSource):
+
+    def __init__(self, src=0):
+        """
+        a webcam. on linux this uses the V4L2 backend with the MJPG fourcc, otherwise
+        it uses whatever backend opencv picks.
+        :param src: device index
+        """
+        if platform.system() == 'Linux':
+            self.capture = cv2.VideoCapture(src, cv2.CAP_V4L2)
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
+        else:
+            self.capture = cv2.VideoCapture(src)
+        self.raw = False
+
+    def set_raw(self, raw=True):
+        """
+        turn off opencv's decoding so retrieve_raw() hands back the camera's MJPEG buffers.
+        while raw is True, retrieve() and read() will also return the compressed buffers
+        :param raw: bool
+        :return: True if the backend supports it. if it doesn't, raw is left as it was and
+        retrieve_raw() keeps encoding the decoded frames
+        """
+        supported = self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 0 if raw is True else 1)
+        if supported is True:
+            self.raw = raw
+        return supported
+
+    def grab(self):
+        return self.capture.grab()
+
+    def retrieve(self, image=None):
+        return self.capture.retrieve(image=image)
+
+    def retrieve_raw(self):
+        if self.raw is False:
+            return super().retrieve_raw()
+        grabbed, buffer = self.capture.retrieve()
+        if grabbed is False or buffer is None:
+            return False, None
+        if buffer.ndim == 3:
+            # the backend said yes but decoded the frame anyway
+            return cv2.imencode('.jpg', buffer)
+        return True, buffer.reshape(-1)
+
+    def read(self, image=None):
+        return self.capture.read(image=image)
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(V4L2Source):
+
+    def __init__(self, path, realtime=True, loop=False):
+        """
+        replays a video file. if realtime is True, frames are handed out on the
+        schedule given by the file's timestamps, otherwise they come as fast as
+        they can be decoded.
+        :param path: path to the video file
+        :param realtime: bool
+        :param loop: if True, start again from the beginning at the end of the file
+        """
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        self.raw = False
+        self.realtime = realtime
+        self.loop = loop
+        self._t0 = None # wall clock time of the first frame
+
+    def grab(self):
+        grabbed = self.capture.grab()
+        if grabbed is False and self.loop is True:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self._t0 = None
+            grabbed = self.capture.grab()
+
+        if grabbed is True and self.realtime is True:
+            timestamp = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if self._t0 is None:
+                self._t0 = time.time() - timestamp
+            wait = self._t0 + timestamp - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+        return grabbed
+
+    def read(self, image=None):
+        return CaptureSource.read(self, image=image)
+
+    def set_raw(self, raw=True):
+        # files are always decoded by opencv and re-encoded by retrieve_raw()
+        return False
+
+    def set(self, prop, value):
+        # a recording can't change its size or frame rate
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT,
+                    cv2.CAP_PROP_FPS, cv2.CAP_PROP_FOURCC):
+            return False
+        return self.capture.set(prop, value)
+
+
+class SyntheticSource(CaptureSource):
+
+    def __init__(self, dim=(1920, 1080), fps=30, realtime=True, pattern='bars'):
+        """
+        generates a test pattern at any resolution and frame rate. every frame
+        has a square that moves across the screen and the frame number in the
+        corner so dropped and repeated frames are easy to spot.
+        :param dim: (width, height)
+        :param fps: frames per second
+        :param realtime: if False, frames come as fast as they can be drawn
+        :param pattern: 'bars' for color bars, 'noise' for random noise
+        """
+        self.pattern = pattern
+        self.realtime = realtime
+        self._fps = fps
+        self.dim = tuple(dim)
+        self.n_frames = -1
+        self._next_t = None
+        self._encoded = {}
+        self._make_background()
+
+    def _make_background(self):
+        w, h = self.dim
+        if self.pattern == 'noise':
+            self.background = np.random.randint(0, 256, (h, w, 3), dtype='uint8')
+        else:
+            colors = np.array([(255, 255, 255), (0, 255, 255), (255, 255, 0), (0, 255, 0),
+                               (255, 0, 255), (0, 0, 255), (255, 0, 0), (0, 0, 0)],
+                              dtype='uint8')
+            columns = np.arange(w) * len(colors) // w
+            self.background = np.broadcast_to(colors[columns], (h, w, 3)).copy()
+        self._encoded = {}
+
+    def grab(self):
+        if self.realtime is True:
+            now = time.time()
+            if self._next_t is None:
+                self._next_t = now
+            elif self._next_t > now:
+                time.sleep(self._next_t - now)
+            self._next_t += 1 / self._fps
+
+        self.n_frames += 1
+        return True
+
+    def retrieve(self, image=None):
+        w, h = self.dim
+        if image is None or image.shape != (h, w, 3):
+            image = np.empty((h, w, 3), dtype='uint8')
+
+        np.copyto(image, self.background)
+        side = h // 8
+        x = (self.n_frames * 8) % (w - side)
+        y = (h - side) // 2
+        image[y:y + side, x:x + side] = 255
+        cv2.putText(image, str(self.n_frames), (10, h - 20),
+                    cv2.FONT_HERSHEY_DUPLEX, 2, (0, 0, 0), 2)
+        return True, image
+
+    def retrieve_raw(self, n_cached=60):
+        """
+        jpeg encoded frames. the first n_cached frames are encoded once and then
+        replayed so that encoding doesn't slow down the source
+        :param n_cached: number of distinct encoded frames to keep
+        """
+        key = self.n_frames % n_cached
+        if key not in self._encoded:
+            encoded, buffer = super().retrieve_raw()
+            if encoded is False:
+                return False, None
+            self._encoded[key] = buffer
+        return True, self._encoded[key]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.dim[0]
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.dim[1]
+        elif prop == cv2.CAP_PROP_FPS:
+            return self._fps
+        elif prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.n_frames + 1
+        elif prop == cv2.CAP_PROP_POS_MSEC:
+            return 1000 * self.n_frames / self._fps
+        return 0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.dim = int(value), self.dim[1]
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.dim = self.dim[0], int(value)
+        elif prop == cv2.CAP_PROP_FPS:
+            self._fps = value
+            return True
+        else:
+            return False
+
+        self._make_background()
+        return True
+
+
+def make_source(src=0):
+    """
+    turns the src argument of CameraPlayer into a CaptureSource
+    :param src: a CaptureSource, a device index or the path to a video file
+    :return: CaptureSource
+    """
+    if isinstance(src, CaptureSource):
+        return src
+    elif isinstance(src, str):
+        return VideoFileSource(src)
+    else:
+        return V4L2Source(src)
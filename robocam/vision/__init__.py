@@ -0,0 +1,4 @@
+import robocam.vision.faces as faces
+import robocam.vision.motion as motion
+import robocam.vision.boxes as boxes
+import robocam.vision.tracking as tracking
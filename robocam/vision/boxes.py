@@ -0,0 +1,186 @@
+"""
+vectorized helpers for (n, 4) arrays of (t, r, b, l) boxes, the order face_recognition uses
+"""
+import cv2
+import numpy as np
+
+
+def as_boxes(boxes):
+    return np.asarray(boxes, dtype='float64').reshape(-1, 4)
+
+
+def areas(boxes):
+    boxes = as_boxes(boxes)
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 1] - boxes[:, 3], 0, None)
+
+
+def expand_boxes(boxes, margin=.5):
+    """
+    grow each box by margin times its width and height on every side
+    """
+    boxes = as_boxes(boxes)
+    t, r, b, l = boxes.T
+    dh, dw = margin * (b - t), margin * (r - l)
+    return np.stack((t - dh, r + dw, b + dh, l - dw), axis=1)
+
+
+def clip_boxes(boxes, shape):
+    """
+    clip boxes to a frame and round them to ints
+    :param shape: frame.shape
+    :return: (n, 4) int64
+    """
+    h, w = shape[:2]
+    boxes = np.rint(as_boxes(boxes)).astype('int64')
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, h)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, w)
+    return boxes
+
+
+def iou_matrix(boxes0, boxes1):
+    """
+    intersection over union of every box in boxes0 with every box in boxes1
+    :return: (n0, n1) float64
+    """
+    a, b = as_boxes(boxes0)[:, None, :], as_boxes(boxes1)[None, :, :]
+    ih = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    iw = np.clip(np.minimum(a[..., 1], b[..., 1]) - np.maximum(a[..., 3], b[..., 3]), 0, None)
+    inter = ih * iw
+    union = areas(boxes0)[:, None] + areas(boxes1)[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def nms(boxes, threshold=.5, scores=None):
+    """
+    drop boxes that overlap a better one by more than threshold iou
+    :param scores: higher is better. defaults to bigger is better
+    :return: indices of the boxes that are kept
+    """
+    boxes = as_boxes(boxes)
+    order = np.argsort(-(areas(boxes) if scores is None else np.asarray(scores)), kind='stable')
+    overlaps = iou_matrix(boxes[order], boxes[order])
+    keep = []
+    suppressed = np.zeros(len(order), dtype='bool')
+    for j in range(len(order)):
+        if suppressed[j]:
+            continue
+        keep.append(order[j])
+        suppressed |= overlaps[j] > threshold
+    return np.array(keep, dtype='int64')
+
+
+def greedy_match(scores, min_score=0.):
+    """
+    pair rows with columns, best score first, using each row and column at most once
+    :param scores: (n, m) array, higher is better i.e. iou_matrix
+    :param min_score: pairs scoring less than this aren't made
+    :return: (k, 2) int64 array of (row, column)
+    """
+    scores = np.asarray(scores)
+    pairs = []
+    if scores.size == 0:
+        return np.zeros((0, 2), dtype='int64')
+    used_rows = np.zeros(scores.shape[0], dtype='bool')
+    used_cols = np.zeros(scores.shape[1], dtype='bool')
+    for flat in np.argsort(-scores, axis=None, kind='stable'):
+        i, j = divmod(int(flat), scores.shape[1])
+        if scores[i, j] < min_score:
+            break
+        if used_rows[i] or used_cols[j]:
+            continue
+        used_rows[i] = used_cols[j] = True
+        pairs.append((i, j))
+    return np.array(pairs, dtype='int64').reshape(-1, 2)
+
+
+def linear_assignment(cost):
+    """
+    minimum cost assignment of rows to columns, the hungarian algorithm with potentials.
+    O(n^2 m) with the inner loop over columns done by numpy, which is plenty for the
+    tens of boxes in a frame. same answer as scipy.optimize.linear_sum_assignment
+    :param cost: (n, m) array. use a big finite number for pairs that shouldn't be made
+    :return: (min(n, m), 2) int64 array of (row, column)
+    """
+    cost = np.asarray(cost, dtype='float64')
+    if cost.size == 0:
+        return np.zeros((0, 2), dtype='int64')
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # 1 indexed, row/column 0 is a sentinel
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype='int64') # row assigned to each column
+    way = np.zeros(m + 1, dtype='int64')
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype='bool')
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # flip the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    columns = np.flatnonzero(p[1:])
+    pairs = np.stack((p[1:][columns] - 1, columns), axis=1)
+    if transposed:
+        pairs = pairs[:, ::-1]
+    return pairs[np.argsort(pairs[:, 0])].astype('int64')
+
+
+def locate_in_rois(locate, frame, boxes, margin=.5, face_px=96, max_zoom=2.):
+    """
+    run a face locator only on the regions around boxes where faces were last seen.
+    each region is resized so the face in it is about face_px wide, so small faces are
+    searched at a higher resolution than a full frame pass and big ones at a lower one
+    :param locate: function that takes an image and returns a list of (t, r, b, l)
+    :param frame: image to search
+    :param boxes: (n, 4) boxes in frame pixels
+    :param margin: see expand_boxes
+    :param face_px: width a face should be in the searched region
+    :param max_zoom: limit on upscaling
+    :return: (m, 4) int64 boxes in frame pixels, number of pixels searched
+    """
+    boxes = as_boxes(boxes)
+    regions = clip_boxes(expand_boxes(boxes, margin), frame.shape)
+    found = []
+    pixels = 0
+    for (t, r, b, l), width in zip(regions, boxes[:, 1] - boxes[:, 3]):
+        if b - t < 2 or r - l < 2:
+            continue
+        zoom = min(face_px / max(width, 1), max_zoom)
+        region = frame[t:b, l:r]
+        if abs(zoom - 1) > .05:
+            interpolation = cv2.INTER_AREA if zoom < 1 else cv2.INTER_LINEAR
+            region = cv2.resize(region, None, fx=zoom, fy=zoom, interpolation=interpolation)
+        else:
+            zoom = 1.
+            region = np.ascontiguousarray(region)
+        pixels += region.shape[0] * region.shape[1]
+        for ft, fr, fb, fl in locate(region):
+            found.append((ft / zoom + t, fr / zoom + l, fb / zoom + t, fl / zoom + l))
+
+    found = clip_boxes(found, frame.shape)
+    # neighbouring regions can find the same face
+    return found[nms(found)], pixels
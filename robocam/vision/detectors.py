@@ -0,0 +1,170 @@
+"""
+interchangeable face detector backends. every backend takes RGB uint8 images and
+returns boxes as (n, 4) int64 arrays of (t, r, b, l), the order face_recognition uses.
+face_recognition is imported when a backend that needs it is made, so the opencv
+backends work without it.
+"""
+import abc
+import os
+
+import cv2
+import numpy as np
+
+
+class Detector(abc.ABC):
+
+    name = 'detector'
+
+    @abc.abstractmethod
+    def __init__(self, *args, encoder=None, **kwargs):
+        """
+        abstract base class for face detectors. subclasses need to implement locate.
+        backends that can't tell faces apart hand encoding off to encoder
+        :param encoder: a Detector that can encode, i.e. FaceRecognitionDetector
+        """
+        self.encoder = encoder
+
+    @abc.abstractmethod
+    def locate(self, image):
+        """
+        find faces
+        :param image: RGB uint8 image
+        :return: (n, 4) int64 array of (t, r, b, l)
+        """
+        return np.zeros((0, 4), dtype='int64')
+
+    def encode(self, image, boxes):
+        """
+        an identity encoding for each box
+        :param image: RGB uint8 image
+        :param boxes: (n, 4) (t, r, b, l)
+        :return: (n, d) float32 array or None if there is no encoder
+        """
+        if self.encoder is None:
+            return None
+        return self.encoder.encode(image, boxes)
+
+    @staticmethod
+    def _boxes(boxes):
+        return np.array(boxes, dtype='int64').reshape(-1, 4)
+
+
+class FaceRecognitionDetector(Detector):
+
+    def __init__(self, model='hog', upsample=1, jitters=1):
+        """
+        dlib's HOG or CNN detector and 128d encodings through face_recognition
+        :param model: 'hog' or 'cnn'
+        :param upsample: number of times to upsample the image before looking for faces
+        :param jitters: number of times to resample each face when encoding
+        """
+        import face_recognition
+        super().__init__()
+        self.face_recognition = face_recognition
+        self.model = model
+        self.upsample = upsample
+        self.jitters = jitters
+        self.name = model
+
+    def locate(self, image):
+        return self._boxes(self.face_recognition.face_locations(image, self.upsample, model=self.model))
+
+    def encode(self, image, boxes):
+        # dlib wants python ints
+        locations = [tuple(int(v) for v in box) for box in np.asarray(boxes).reshape(-1, 4)]
+        encodings = self.face_recognition.face_encodings(image, locations, num_jitters=self.jitters)
+        return np.array(encodings, dtype='float32').reshape(len(locations), -1)
+
+
+class CascadeDetector(Detector):
+
+    _DEFAULT_FILES = {'haar': 'haarcascade_frontalface_default.xml',
+                      'lbp': 'lbpcascade_frontalface_improved.xml'}
+
+    def __init__(self, path=None, kind='haar', scale_factor=1.1, min_neighbors=5,
+                 min_size=(30, 30), encoder=None):
+        """
+        an opencv Haar or LBP cascade. very fast on a cpu but only finds faces that are close
+        to looking straight at the camera.
+        :param path: the cascade's xml file. defaults to the file of that kind that ships with opencv
+        :param kind: 'haar' or 'lbp'
+        :param scale_factor: image pyramid step, bigger is faster and misses more
+        :param min_neighbors: overlapping hits needed to count as a face
+        :param min_size: smallest face (width, height) in pixels
+        """
+        super().__init__(encoder=encoder)
+        if path is None:
+            path = os.path.join(cv2.data.haarcascades, self._DEFAULT_FILES[kind])
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise FileNotFoundError(f'could not load a cascade from {path}')
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = tuple(min_size)
+        self.name = kind
+
+    def locate(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        cv2.equalizeHist(gray, dst=gray)
+        found = self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors, minSize=self.min_size)
+        found = self._boxes(found)
+        x, y, w, h = found.T
+        return np.stack((y, x + w, y + h, x), axis=1)
+
+
+class DNNDetector(Detector):
+
+    def __init__(self, model_path, config_path=None, confidence=.5, size=(300, 300),
+                 mean=(104., 177., 123.), encoder=None):
+        """
+        an SSD style detector through cv2.dnn, i.e. the res10_300x300_ssd caffe model. the
+        defaults are for that model. anything readNet can load that outputs (1, 1, n, 7)
+        detections of (_, _, confidence, x0, y0, x1, y1) with coordinates from 0 to 1 will work.
+        :param model_path: weights file, i.e. .caffemodel, .onnx or .pb
+        :param config_path: network description, i.e. .prototxt, if the weights need one
+        :param confidence: lowest confidence that counts as a face
+        :param size: (width, height) the network takes
+        :param mean: BGR mean subtracted from the input
+        """
+        super().__init__(encoder=encoder)
+        self.net = cv2.dnn.readNet(model_path, '' if config_path is None else config_path)
+        self.confidence = confidence
+        self.size = tuple(size)
+        self.mean = mean
+        self.name = 'dnn'
+
+    def locate(self, image):
+        h, w = image.shape[:2]
+        # images come in RGB, the network was trained on BGR
+        blob = cv2.dnn.blobFromImage(image, 1., self.size, self.mean, swapRB=True, crop=False)
+        self.net.setInput(blob)
+        found = self.net.forward().reshape(-1, 7)
+        found = found[found[:, 2] >= self.confidence]
+        x0, y0, x1, y1 = (found[:, 3:7] * (w, h, w, h)).T
+        boxes = np.stack((y0, x1, y1, x0), axis=1)
+        boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, h)
+        boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, w)
+        return np.rint(boxes).astype('int64').reshape(-1, 4)
+
+
+def make_detector(name='hog', model_path=None, config_path=None, encode=True):
+    """
+    make a detector by name
+    :param name: 'hog', 'cnn', 'haar', 'lbp' or 'dnn'
+    :param model_path: cascade xml for 'haar' and 'lbp' (optional), network weights for 'dnn'
+    :param config_path: network description for 'dnn'
+    :param encode: if True the opencv backends get a face_recognition encoder
+    :return: Detector
+    """
+    if name in ('hog', 'cnn'):
+        return FaceRecognitionDetector(model=name)
+
+    encoder = FaceRecognitionDetector() if encode is True else None
+    if name in ('haar', 'lbp'):
+        return CascadeDetector(model_path, kind=name, encoder=encoder)
+    elif name == 'dnn':
+        if model_path is None:
+            raise ValueError('the dnn detector needs a model_path')
+        return DNNDetector(model_path, config_path, encoder=encoder)
+    raise ValueError(f'unknown detector {name}')
@@ -0,0 +1,513 @@
+"""
+tools for face recognition that don't depend on a particular model
+"""
+import os
+import time
+import hashlib
+import tempfile
+from queue import Queue
+
+import cv2
+import numpy as np
+
+from robocam.vision import boxes as vboxes
+
+
+def name_from_file(file):
+    """
+    the name of the person in a photo from its file name, everything
+    before the first digit, '.' or '-' i.e. 'Keith2.jpg' -> 'Keith'
+    """
+    name = ""
+    for char in os.path.basename(file):
+        if char.isdigit() or char in ('.', '-'):
+            break
+        name += char
+    return name.strip()
+
+
+def identity_names(folder):
+    """
+    the people in a folder of photos. a person's identity id is their index in this list.
+    names are unique ignoring case and keep the spelling of their first photo in sorted order
+    :return: list of names
+    """
+    names = []
+    seen = set()
+    for file in sorted(os.listdir(folder)):
+        name = name_from_file(file)
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    sha1 of a file's contents
+    :param path: path to the file
+    :return: hex digest string
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class EncodingCache:
+
+    def __init__(self, path, params='', dim=128):
+        """
+        an on disk cache of face encodings keyed by the sha1 of the photo and the
+        model parameters that made them. photos are only re-encoded if they are new or
+        changed, or if params changes, so startup doesn't scale with the size of the gallery.
+
+        cache = EncodingCache(path, params='hog-jitters1')
+        encoding = cache.get(image_path, encode_fn)
+        cache.save()
+
+        photos with no face are remembered too so they aren't re-encoded every time.
+        :param path: path to the .npz file
+        :param params: string describing the model. if it doesn't match what's in the file,
+                       the cache is thrown out
+        :param dim: length of an encoding
+        """
+        self.path = path
+        self.params = params
+        self.dim = dim
+        self.n_hits = 0
+        self.n_misses = 0
+        self._entries = {} # digest -> float32 encoding or None if there's no face
+        self._used = set()
+        self._changed = False
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data['params']) != self.params:
+                    self._changed = True
+                    return
+                digests = data['digests']
+                encodings = data['encodings']
+                found = data['found']
+        except (OSError, KeyError, ValueError):
+            # a broken cache is the same as no cache
+            self._changed = True
+            return
+
+        for digest, encoding, face in zip(digests, encodings, found):
+            self._entries[str(digest)] = encoding if face else None
+
+    def get(self, path, encode_fn):
+        """
+        the encoding of the photo at path. if it isn't cached, encode_fn(path) is called
+        :param path: path to the photo
+        :param encode_fn: function that takes a path and returns an encoding or None if there's no face
+        :return: float32 array of length dim or None
+        """
+        digest = file_digest(path)
+        self._used.add(digest)
+        if digest in self._entries:
+            self.n_hits += 1
+            return self._entries[digest]
+
+        self.n_misses += 1
+        encoding = encode_fn(path)
+        if encoding is not None:
+            encoding = np.asarray(encoding, dtype='float32')
+        self._entries[digest] = encoding
+        self._changed = True
+        return encoding
+
+    def save(self, prune=True):
+        """
+        writes the cache if anything changed. the file is written to a temp file next to the old one
+        and then moved over it so a crash or another process saving at the same time can't leave
+        a half written cache
+        :param prune: if True, drop photos that weren't asked for with get() since loading
+        """
+        if prune is True and self._used != set(self._entries):
+            self._entries = {d: e for d, e in self._entries.items() if d in self._used}
+            self._changed = True
+        if self._changed is False:
+            return
+
+        digests = list(self._entries)
+        encodings = np.zeros((len(digests), self.dim), dtype='float32')
+        found = np.zeros(len(digests), dtype='bool')
+        for i, digest in enumerate(digests):
+            if self._entries[digest] is not None:
+                encodings[i] = self._entries[digest]
+                found[i] = True
+
+        # every model worker can save at once, so each one writes its own temp file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, params=np.array(self.params), digests=np.array(digests, dtype='U40'),
+                         encodings=encodings, found=found)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._changed = False
+
+
+def kmeans(points, k, n_iter=10, seed=0):
+    """
+    plain lloyd's k-means. good enough for partitioning a gallery, not for clustering
+    :param points: (n, d) float32 array
+    :param k: number of centroids
+    :return: (k, d) centroids, (n,) index of each point's centroid
+    """
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = _nearest(points, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, points)
+        # empty centroids stay where they are
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids, _nearest(points, centroids)
+
+
+def _nearest(points, centroids):
+    sq = (centroids * centroids).sum(axis=1) - 2 * points @ centroids.T
+    return np.argmin(sq, axis=1)
+
+
+class FaceGallery:
+
+    def __init__(self, encodings, labels=None, threshold=.6,
+                 approximate_above=4096, n_probe=8, seed=0):
+        """
+        known face encodings in one contiguous float32 matrix so all the faces in a frame
+        are matched with one matrix product. distances are euclidean, the same as
+        face_recognition.face_distance, using |a - b|^2 = |a|^2 + |b|^2 - 2a.b with the
+        gallery's squared norms computed once.
+
+        above approximate_above encodings the gallery is split into ~sqrt(n) k-means
+        partitions and each face is only compared to the n_probe partitions with the
+        closest centroids. each partition is a contiguous block of the matrix.
+
+        gallery = FaceGallery(known_encodings, labels=ids_of_each_encoding)
+        labels, distances = gallery.match(observed_encodings, k=1)
+
+        :param encodings: (n, d) array like
+        :param labels: the id of each encoding. several encodings can have the same id.
+                       default is the row number
+        :param threshold: matches farther than this get the label -1
+        :param approximate_above: use the partitioned index when there are more encodings than this
+        :param n_probe: partitions searched per face with the partitioned index
+        """
+        encodings = np.asarray(encodings, dtype='float32')
+        self.dim = encodings.shape[1] if encodings.ndim == 2 else 128
+        encodings = encodings.reshape(-1, self.dim)
+        n = len(encodings)
+        labels = np.arange(n) if labels is None else np.asarray(labels, dtype='int64')
+
+        self.threshold = threshold
+        self.n_probe = n_probe
+        self.approximate = n > approximate_above
+
+        if self.approximate is True:
+            n_lists = int(np.sqrt(n))
+            self.centroids, assignment = kmeans(encodings, n_lists, seed=seed)
+            self._centroid_sq_norms = (self.centroids * self.centroids).sum(axis=1)
+            order = np.argsort(assignment, kind='stable')
+            encodings = encodings[order]
+            labels = labels[order]
+            counts = np.bincount(assignment, minlength=n_lists)
+            self._offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        self.encodings = np.ascontiguousarray(encodings)
+        self.labels = labels
+        self._sq_norms = (self.encodings * self.encodings).sum(axis=1)
+
+    def __len__(self):
+        return len(self.encodings)
+
+    @staticmethod
+    def _distances(queries, encodings, sq_norms):
+        sq = (queries * queries).sum(axis=1)[:, None] + sq_norms[None, :] - 2 * queries @ encodings.T
+        return np.sqrt(np.maximum(sq, 0, out=sq), out=sq)
+
+    def _top_k(self, distances, k):
+        n = distances.shape[1]
+        kk = min(k, n)
+        rows = np.arange(len(distances))[:, None]
+        if kk < n:
+            idx = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+        else:
+            idx = np.broadcast_to(np.arange(n), distances.shape)
+        idx = idx[rows, np.argsort(distances[rows, idx], axis=1)]
+        return idx, distances[rows, idx]
+
+    def match(self, observed, k=1):
+        """
+        the k closest gallery encodings to each observed encoding
+        :param observed: (m, d) array like of encodings
+        :param k: number of matches per face
+        :return: labels (m, k) int64, distances (m, k) float32. labels are -1 past
+                 the threshold, and -1 with distance inf if there are fewer than k candidates
+        """
+        queries = np.asarray(observed, dtype='float32').reshape(-1, self.dim)
+        m = len(queries)
+        labels = np.full((m, k), -1, dtype='int64')
+        distances = np.full((m, k), np.inf, dtype='float32')
+        if m == 0 or len(self) == 0:
+            return labels, distances
+
+        if self.approximate is False:
+            d = self._distances(queries, self.encodings, self._sq_norms)
+            idx, top = self._top_k(d, k)
+            labels[:, :idx.shape[1]] = self.labels[idx]
+            distances[:, :idx.shape[1]] = top
+        else:
+            d = self._distances(queries, self.centroids, self._centroid_sq_norms)
+            n_probe = min(self.n_probe, len(self.centroids))
+            probes = np.argpartition(d, n_probe - 1, axis=1)[:, :n_probe]
+            offsets = self._offsets
+            for j in range(m):
+                candidates = np.concatenate([np.arange(offsets[c], offsets[c + 1]) for c in probes[j]])
+                if len(candidates) == 0:
+                    continue
+                d = self._distances(queries[j:j + 1], self.encodings[candidates], self._sq_norms[candidates])
+                idx, top = self._top_k(d, k)
+                labels[j, :idx.shape[1]] = self.labels[candidates[idx[0]]]
+                distances[j, :idx.shape[1]] = top[0]
+
+        labels[distances > self.threshold] = -1
+        return labels, distances
+
+
+class IdentityCache:
+
+    def __init__(self, max_age=2., min_iou=.5, max_resize=.2, max_change=12., thumb_size=(16, 16)):
+        """
+        remembers who was in each box so a face that hasn't moved or changed much doesn't
+        have to be encoded again. a new box is matched to a cached one by iou and reuses its
+        identity if that identity was known, the face was encoded less than max_age seconds
+        ago, its size changed by less than max_resize and a tiny grayscale thumbnail of it
+        changed by less than max_change gray levels on average. size and looks are compared
+        with the box as it was when it was last encoded, so slow changes add up.
+
+        cache = IdentityCache()
+        ids, scores, fresh = cache.match(image, boxes)
+        ... encode and match boxes[~fresh], fill in their ids and scores ...
+        cache.update(image, boxes, ids, scores, fresh)
+
+        :param max_age: seconds before a face is encoded again no matter what. 0 turns the cache off
+        :param min_iou: overlap needed to be the same face
+        :param max_resize: largest relative change in box area
+        :param max_change: largest mean absolute change in the thumbnail
+        :param thumb_size: (width, height) of the thumbnails
+        """
+        self.max_age = max_age
+        self.min_iou = min_iou
+        self.max_resize = max_resize
+        self.max_change = max_change
+        self.thumb_size = tuple(thumb_size)
+
+        self.boxes = np.zeros((0, 4), dtype='float64') # where each face was last seen
+        self.anchors = np.zeros((0, 4), dtype='float64') # where each face was when it was encoded
+        self.ids = np.zeros(0, dtype='int64')
+        self.scores = np.zeros(0, dtype='float32')
+        self.stamps = np.zeros(0, dtype='float64') # when each face was encoded
+        self.thumbs = np.zeros((0, thumb_size[1], thumb_size[0]), dtype='uint8')
+        self._matched = np.zeros(0, dtype='int64')
+        self._thumbs = self.thumbs
+        self.n_reused = 0
+        self.n_encoded = 0
+
+    @property
+    def reuse_ratio(self):
+        n = self.n_reused + self.n_encoded
+        return self.n_reused / n if n > 0 else 0.
+
+    def _make_thumbs(self, image, boxes):
+        h, w = image.shape[:2]
+        thumbs = np.zeros((len(boxes), self.thumb_size[1], self.thumb_size[0]), dtype='uint8')
+        for k, (t, r, b, l) in enumerate(np.rint(boxes).astype('int64')):
+            t, b = max(t, 0), min(b, h)
+            l, r = max(l, 0), min(r, w)
+            if b - t < 2 or r - l < 2:
+                continue
+            small = cv2.resize(image[t:b, l:r], self.thumb_size, interpolation=cv2.INTER_AREA)
+            thumbs[k] = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        return thumbs
+
+    def match(self, image, boxes, now=None):
+        """
+        :param image: the image boxes are in
+        :param boxes: (n, 4) (t, r, b, l)
+        :return: ids (n,), scores (n,), fresh (n,) bool. where fresh is True the cached
+                 id and score can be used instead of encoding
+        """
+        boxes = np.asarray(boxes, dtype='float64').reshape(-1, 4)
+        n = len(boxes)
+        now = time.time() if now is None else now
+        ids = np.full(n, -1, dtype='int64')
+        scores = np.zeros(n, dtype='float32')
+        fresh = np.zeros(n, dtype='bool')
+        self._matched = np.full(n, -1, dtype='int64')
+        self._thumbs = self._make_thumbs(image, boxes) if self.max_age > 0 else self.thumbs[:0]
+        if self.max_age <= 0 or n == 0 or len(self.boxes) == 0:
+            return ids, scores, fresh
+
+        for i, j in vboxes.greedy_match(vboxes.iou_matrix(boxes, self.boxes), self.min_iou):
+            self._matched[i] = j
+            area, anchor_area = vboxes.areas(boxes[i])[0], vboxes.areas(self.anchors[j])[0]
+            change = np.mean(cv2.absdiff(self._thumbs[i], self.thumbs[j]))
+            if (self.ids[j] >= 0 and now - self.stamps[j] < self.max_age
+                    and abs(area / max(anchor_area, 1) - 1) < self.max_resize
+                    and change < self.max_change):
+                ids[i], scores[i], fresh[i] = self.ids[j], self.scores[j], True
+
+        return ids, scores, fresh
+
+    def update(self, image, boxes, ids, scores, fresh, now=None):
+        """
+        replace the cache with the faces from the last match(). faces that were reused keep
+        the anchor box, thumbnail and time from when they were encoded
+        """
+        if self.max_age <= 0:
+            return
+        boxes = np.asarray(boxes, dtype='float64').reshape(-1, 4)
+        now = time.time() if now is None else now
+        fresh = np.asarray(fresh, dtype='bool')
+        n_fresh = int(np.count_nonzero(fresh))
+        self.n_reused += n_fresh
+        self.n_encoded += len(boxes) - n_fresh
+
+        anchors = np.array(boxes)
+        stamps = np.full(len(boxes), now)
+        thumbs = np.array(self._thumbs)
+        old = self._matched[fresh]
+        anchors[fresh] = self.anchors[old]
+        stamps[fresh] = self.stamps[old]
+        thumbs[fresh] = self.thumbs[old]
+
+        self.boxes = boxes
+        self.anchors = anchors
+        self.ids = np.asarray(ids, dtype='int64').copy()
+        self.scores = np.asarray(scores, dtype='float32').copy()
+        self.stamps = stamps
+        self.thumbs = thumbs
+
+
+class IdentityStore:
+
+    def __init__(self, names, max_unknown=32, window=1.5, min_hits=10, forget_after=30.):
+        """
+        what's known about everyone who has been seen, in arrays indexed by identity. known
+        people are 0 to len(names) - 1. unknown people are kept by track id in max_unknown
+        extra rows, which are reused for whoever was seen longest ago once they run out and
+        freed after forget_after seconds without a sighting.
+
+        a known person gets one hello, once they've been seen in at least min_hits updates
+        within window seconds, so a bad match on a frame or two doesn't greet the wrong person.
+
+        store = IdentityStore(names)
+        rows = store.update(identity_ids, track_ids)
+        store.name(rows[0])
+        if store.hello_queue.empty() is False: identity, line = store.hello_queue.get()
+
+        :param names: names of the known people
+        :param max_unknown: rows for unknown people
+        :param window: seconds
+        :param min_hits: sightings in window needed for a hello
+        :param forget_after: seconds before an unknown person's row is freed
+        """
+        self.names = list(names)
+        self.n_known = len(self.names)
+        self.capacity = self.n_known + max_unknown
+        self.window = window
+        self.min_hits = min_hits
+        self.forget_after = forget_after
+
+        self.first_seen = np.full(self.capacity, -np.inf)
+        self.last_seen = np.full(self.capacity, -np.inf)
+        self.hits = np.zeros(self.capacity, dtype='int64')
+        self.greeted = np.zeros(self.capacity, dtype='bool')
+        # the last min_hits sighting times of each row, as a ring
+        self._sightings = np.full((self.capacity, min_hits), -np.inf)
+        self._cursor = np.zeros(self.capacity, dtype='int64')
+        # track id of the unknown person in each unknown row, -1 if free
+        self.unknown_tracks = np.full(max_unknown, -1, dtype='int64')
+        self.hello_queue = Queue()
+
+    def _clear(self, rows):
+        self.first_seen[rows] = self.last_seen[rows] = -np.inf
+        self.hits[rows] = 0
+        self.greeted[rows] = False
+        self._sightings[rows] = -np.inf
+        self._cursor[rows] = 0
+
+    def _unknown_rows(self, track_ids, now):
+        # free rows nobody has been seen in for a while
+        last_seen = self.last_seen[self.n_known:]
+        stale = (self.unknown_tracks >= 0) & (now - last_seen > self.forget_after)
+        self.unknown_tracks[stale] = -1
+        self._clear(self.n_known + np.flatnonzero(stale))
+
+        rows = np.full(len(track_ids), -1, dtype='int64')
+        for k, track_id in enumerate(track_ids):
+            if track_id < 0 or len(self.unknown_tracks) == 0:
+                continue
+            found = np.flatnonzero(self.unknown_tracks == track_id)
+            if len(found) > 0:
+                row = found[0]
+            else:
+                free = np.flatnonzero(self.unknown_tracks < 0)
+                # out of rows, take over the one seen longest ago
+                row = free[0] if len(free) > 0 else int(np.argmin(self.last_seen[self.n_known:]))
+                self.unknown_tracks[row] = track_id
+                self._clear(self.n_known + row)
+            rows[k] = self.n_known + row
+        return rows
+
+    def update(self, ids, track_ids=None, now=None):
+        """
+        record a batch of sightings, i.e. one model result
+        :param ids: (n,) identity ids, -1 for unknown
+        :param track_ids: (n,) track ids so unknown people can be told apart
+        :param now: time.time() of the sightings
+        :return: (n,) row of each sighting, -1 if it couldn't be kept
+        """
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        now = time.time() if now is None else now
+        rows = np.where((ids >= 0) & (ids < self.n_known), ids, -1)
+        if track_ids is not None:
+            unknown = rows < 0
+            rows[unknown] = self._unknown_rows(np.asarray(track_ids, dtype='int64').reshape(-1)[unknown], now)
+
+        seen = np.unique(rows[rows >= 0])
+        if len(seen) == 0:
+            return rows
+        new = self.hits[seen] == 0
+        self.first_seen[seen[new]] = now
+        self.last_seen[seen] = now
+        self.hits[seen] += 1
+        self._sightings[seen, self._cursor[seen] % self.min_hits] = now
+        self._cursor[seen] += 1
+
+        # everyone in the batch is checked against the window at once
+        recent = np.count_nonzero(self._sightings[seen] > now - self.window, axis=1)
+        ready = seen[(recent >= self.min_hits) & ~self.greeted[seen] & (seen < self.n_known)]
+        self.greeted[ready] = True
+        for row in ready:
+            self.hello_queue.put((int(row), f'Hello {self.names[row]}, welcome!'))
+        return rows
+
+    def name(self, row):
+        """
+        name of a known person, "" for anyone else
+        """
+        return self.names[row] if 0 <= row < self.n_known else ""
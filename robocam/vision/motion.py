@@ -0,0 +1,71 @@
+"""
+cheap checks for whether anything in front of the camera has changed
+"""
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+
+    def __init__(self, threshold=.005, refresh=2., size=(64, 36), pixel_threshold=12):
+        """
+        decides if a frame is worth running an expensive model on. each frame is shrunk to a
+        tiny grayscale thumbnail and compared with the thumbnail of the last frame that was let
+        through. the motion score is the fraction of thumbnail pixels that changed by more than
+        pixel_threshold. a frame goes through if the score is over threshold, if refresh seconds
+        have gone by since the last one, or if it's forced.
+
+        gate = MotionGate()
+        if gate(frame) is True:
+            run_the_model(frame)
+
+        :param threshold: fraction of changed pixels that counts as motion. 0 lets everything through
+        :param refresh: longest time in seconds between frames that go through
+        :param size: (width, height) of the thumbnail
+        :param pixel_threshold: change in gray level that counts as a changed pixel
+        """
+        self.threshold = threshold
+        self.refresh = refresh
+        self.size = tuple(size)
+        self.pixel_threshold = pixel_threshold
+
+        self.reference = None
+        self._small = np.zeros((size[1], size[0], 3), dtype='uint8')
+        self._thumb = np.zeros((size[1], size[0]), dtype='uint8')
+        self._diff = np.zeros((size[1], size[0]), dtype='uint8')
+        self._last_open = 0.
+        self.motion = 0.
+        self.n_frames = 0
+        self.n_skipped = 0
+
+    @property
+    def skip_ratio(self):
+        return self.n_skipped / self.n_frames if self.n_frames > 0 else 0.
+
+    def __call__(self, frame, force=False):
+        """
+        :param frame: BGR or RGB frame of any size
+        :param force: let the frame through no matter what
+        :return: True if the frame should be processed
+        """
+        cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._thumb)
+        self.n_frames += 1
+
+        if self.reference is None:
+            self.motion = 1.
+        else:
+            cv2.absdiff(self._thumb, self.reference, dst=self._diff)
+            self.motion = np.count_nonzero(self._diff > self.pixel_threshold) / self._diff.size
+
+        now = time.time()
+        if (force is True or self.reference is None or self.motion > self.threshold
+                or now - self._last_open > self.refresh):
+            self.reference = np.array(self._thumb)
+            self._last_open = now
+            return True
+
+        self.n_skipped += 1
+        return False
@@ -0,0 +1,399 @@
+"""
+cheap trackers that move boxes between runs of an expensive detector
+"""
+from collections import deque
+
+import cv2
+import numpy as np
+
+from robocam.vision import boxes as vboxes
+
+
+class FlowTracker:
+
+    def __init__(self, scale=1., max_points=24, min_points=5, history=16,
+                 win_size=(15, 15), max_level=2):
+        """
+        moves boxes from frame to frame with pyramidal Lucas-Kanade optical flow on corner
+        features inside each box. every frame is pushed with push(). when the detector finishes
+        with an older frame, reset() re-anchors the boxes on that frame and tracks them forward
+        through the frames since, so a slow detector doesn't drag the boxes back in time.
+
+        boxes are (t, r, b, l) in full frame pixels going in and coming out. the tracker works
+        on small grayscale frames that are scale times the size of the full frame.
+
+        tracker = FlowTracker(scale=.5)
+        tracker.push(small_gray_frame, seq)
+        tracker.reset(detected_boxes, ids, seq_of_the_detected_frame)
+        boxes, ids = tracker.full_boxes, tracker.ids
+
+        :param scale: size of the tracking frames relative to the full frame
+        :param max_points: corners per box
+        :param min_points: a box with fewer good points than this is lost
+        :param history: number of past frames kept for reset()
+        """
+        self.scale = scale
+        self.max_points = max_points
+        self.min_points = min_points
+        self.win_size = win_size
+        self.max_level = max_level
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, .03)
+
+        self._frames = deque(maxlen=history) # (seq, gray frame)
+        self.boxes = np.zeros((0, 4), dtype='float32') # tracking frame pixels
+        self.ids = np.zeros(0, dtype='int64')
+        self.alive = np.zeros(0, dtype='bool')
+        self._points = []
+
+    @property
+    def n(self):
+        return len(self.boxes)
+
+    @property
+    def seq(self):
+        """
+        seq of the last frame pushed. -1 if there isn't one
+        """
+        return self._frames[-1][0] if len(self._frames) > 0 else -1
+
+    @property
+    def n_lost(self):
+        return int(np.count_nonzero(~self.alive))
+
+    @property
+    def full_boxes(self):
+        """
+        boxes as (n, 4) int64 (t, r, b, l) in full frame pixels
+        """
+        return np.rint(self.boxes / self.scale).astype('int64')
+
+    def push(self, gray, seq):
+        """
+        move every box to a new frame
+        :param gray: 2d uint8 frame at the tracking scale
+        :param seq: frame sequence number
+        """
+        if len(self._frames) > 0:
+            self._step(self._frames[-1][1], gray)
+        self._frames.append((seq, gray))
+
+    def reset(self, boxes, ids, seq):
+        """
+        replace the tracks with new detections
+        :param boxes: (n, 4) (t, r, b, l) full frame boxes found in frame seq
+        :param ids: (n,) identity of each box
+        :param seq: the frame the detections came from
+        """
+        self.boxes = np.array(boxes, dtype='float32').reshape(-1, 4) * self.scale
+        self.ids = np.array(ids, dtype='int64').reshape(-1)
+        self.alive = np.ones(len(self.boxes), dtype='bool')
+        self._points = [np.zeros((0, 2), dtype='float32')] * len(self.boxes)
+        if len(self._frames) == 0:
+            return
+
+        # start from the detected frame if it's still around, otherwise boxes are as good as they'll get
+        seqs = [s for s, _ in self._frames]
+        start = seqs.index(seq) if seq in seqs else len(seqs) - 1
+        frames = [f for _, f in self._frames]
+        for i in range(self.n):
+            self._seed(frames[start], i)
+        for j in range(start + 1, len(frames)):
+            self._step(frames[j - 1], frames[j])
+
+    def clear(self):
+        self.reset(np.zeros((0, 4)), np.zeros(0), self.seq)
+
+    def _seed(self, gray, i):
+        h, w = gray.shape[:2]
+        t, r, b, l = np.rint(self.boxes[i]).astype('int64')
+        t, b = np.clip((t, b), 0, h)
+        l, r = np.clip((l, r), 0, w)
+        points = None
+        if b - t > 2 and r - l > 2:
+            points = cv2.goodFeaturesToTrack(gray[t:b, l:r], self.max_points, .01, 3)
+        if points is None:
+            self._points[i] = np.zeros((0, 2), dtype='float32')
+        else:
+            self._points[i] = points.reshape(-1, 2) + np.array((l, t), dtype='float32')
+
+    def _step(self, prev, gray):
+        if self.n == 0:
+            return
+        counts = [len(p) if self.alive[i] else 0 for i, p in enumerate(self._points)]
+        if sum(counts) == 0:
+            self.alive[:] = False
+            return
+
+        # all of the boxes' points go through opencv in one call
+        p0 = np.concatenate([p for p, c in zip(self._points, counts) if c > 0]).reshape(-1, 1, 2)
+        p1, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, p0, None, winSize=self.win_size,
+                                                 maxLevel=self.max_level, criteria=self.criteria)
+        p0, p1, status = p0.reshape(-1, 2), p1.reshape(-1, 2), status.reshape(-1) == 1
+
+        start = 0
+        for i, count in enumerate(counts):
+            if count == 0:
+                self.alive[i] = False
+                continue
+            good = status[start:start + count]
+            a, b = p0[start:start + count][good], p1[start:start + count][good]
+            start += count
+            if len(a) < self.min_points:
+                self.alive[i] = False
+                continue
+            self._move(i, a, b)
+            self._points[i] = b
+            if len(b) < self.max_points // 2:
+                self._seed(gray, i)
+
+    def _move(self, i, a, b):
+        # the median shift and the median change in spread are robust to a few bad points
+        ca, cb = np.median(a, axis=0), np.median(b, axis=0)
+        ra, rb = np.linalg.norm(a - ca, axis=1), np.linalg.norm(b - cb, axis=1)
+        spread = ra > 1
+        s = np.median(rb[spread] / ra[spread]) if np.any(spread) else 1.
+        s = np.clip(s, .8, 1.25)
+
+        t, r, bottom, l = self.boxes[i]
+        cx, cy = (r + l) / 2 + cb[0] - ca[0], (t + bottom) / 2 + cb[1] - ca[1]
+        hw, hh = s * (r - l) / 2, s * (bottom - t) / 2
+        self.boxes[i] = cy - hh, cx + hw, cy + hh, cx - hw
+
+
+class KalmanBoxFilter:
+
+    def __init__(self, capacity, measurement_std=(6., 6., 8., 8.), acceleration_std=(300., 300., 100., 100.),
+                 velocity_std=500., max_horizon=.5):
+        """
+        constant velocity kalman filters for up to capacity boxes, all stepped at once with
+        batched numpy linear algebra. each slot's state is (cx, cy, w, h) and their velocities
+        in pixels and pixels per second, with its own time so measurements can come from
+        whenever the frame they were made on was captured. predict() gives the boxes at any
+        time, so they can be drawn where they are now instead of where the model saw them.
+
+        box_filter = KalmanBoxFilter(5)
+        box_filter.update(slots, detected_boxes, time_the_frame_was_captured)
+        boxes = box_filter.predict(time_of_the_frame_being_drawn)
+
+        :param capacity: number of slots
+        :param measurement_std: noise in a measured (cx, cy, w, h) in pixels
+        :param acceleration_std: how fast (cx, cy, w, h) can change speed in pixels/s^2
+        :param velocity_std: uncertainty in the speed of a new box in pixels/s
+        :param max_horizon: predictions go at most this many seconds past the last measurement
+        """
+        self.capacity = capacity
+        self.R = np.diag(np.square(np.asarray(measurement_std, dtype='float64')))
+        self.q = np.square(np.asarray(acceleration_std, dtype='float64'))
+        self.velocity_var = velocity_std ** 2
+        self.max_horizon = max_horizon
+
+        self.x = np.zeros((capacity, 8))
+        self.P = np.tile(np.eye(8), (capacity, 1, 1))
+        self.t = np.zeros(capacity)
+        self.active = np.zeros(capacity, dtype='bool')
+
+    @staticmethod
+    def to_state(boxes):
+        t, r, b, l = np.asarray(boxes, dtype='float64').reshape(-1, 4).T
+        return np.stack(((r + l) / 2, (t + b) / 2, r - l, b - t), axis=1)
+
+    @staticmethod
+    def to_boxes(z):
+        cx, cy, w, h = z[:, 0], z[:, 1], z[:, 2] / 2, z[:, 3] / 2
+        return np.rint(np.stack((cy - h, cx + w, cy + h, cx - w), axis=1)).astype('int64')
+
+    def _transition(self, dt):
+        n = len(dt)
+        F = np.tile(np.eye(8), (n, 1, 1))
+        F[:, :4, 4:] = dt[:, None, None] * np.eye(4)
+        # white noise acceleration for each of the 4 position/velocity pairs
+        Q = np.zeros((n, 8, 8))
+        q = self.q[None, :]
+        d = dt[:, None]
+        i = np.arange(4)
+        Q[:, i, i] = q * d ** 3 / 3
+        Q[:, i, i + 4] = Q[:, i + 4, i] = q * d ** 2 / 2
+        Q[:, i + 4, i + 4] = q * d
+        return F, Q
+
+    def _predict(self, slots, t):
+        dt = np.clip(t - self.t[slots], 0, None)
+        F, Q = self._transition(dt)
+        x = np.einsum('nij,nj->ni', F, self.x[slots])
+        P = F @ self.P[slots] @ F.transpose(0, 2, 1) + Q
+        return x, P
+
+    def reset(self, slots, boxes, t):
+        """
+        start slots over at boxes with no velocity
+        """
+        slots = np.asarray(slots, dtype='int64').reshape(-1)
+        self.x[slots] = 0
+        self.x[slots, :4] = self.to_state(boxes)
+        self.P[slots] = 0
+        self.P[slots, :4, :4] = self.R
+        self.P[slots, 4:, 4:] = self.velocity_var * np.eye(4)
+        self.t[slots] = t
+        self.active[slots] = True
+
+    def update(self, slots, boxes, t):
+        """
+        correct slots with measured boxes. inactive slots are reset to them
+        :param slots: (k,) slot indices
+        :param boxes: (k, 4) (t, r, b, l)
+        :param t: time.time() the boxes were measured at
+        """
+        slots = np.asarray(slots, dtype='int64').reshape(-1)
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        new = ~self.active[slots]
+        if np.any(new):
+            self.reset(slots[new], boxes[new], t)
+        slots, boxes = slots[~new], boxes[~new]
+        if len(slots) == 0:
+            return
+
+        x, P = self._predict(slots, t)
+        S = P[:, :4, :4] + self.R
+        # K = P H^T S^-1, and both P and S are symmetric
+        K = np.linalg.solve(S, P[:, :4, :]).transpose(0, 2, 1)
+        innovation = self.to_state(boxes) - x[:, :4]
+        self.x[slots] = x + np.einsum('nij,nj->ni', K, innovation)
+        self.P[slots] = P - K @ P[:, :4, :]
+        self.t[slots] = np.maximum(self.t[slots], t)
+
+    def deactivate(self, slots):
+        self.active[slots] = False
+
+    def predict(self, t, slots=None):
+        """
+        boxes at time t, without changing the filters
+        :param slots: which slots, defaults to all of them
+        :return: (k, 4) int64 (t, r, b, l)
+        """
+        slots = np.arange(self.capacity) if slots is None else np.asarray(slots, dtype='int64').reshape(-1)
+        dt = np.clip(t - self.t[slots], 0, self.max_horizon)
+        return self.to_boxes(self.x[slots, :4] + dt[:, None] * self.x[slots, 4:])
+
+
+class TrackManager:
+
+    _NO_MATCH = 1e6
+
+    def __init__(self, capacity, max_distance=1., max_misses=2, hungarian=True):
+        """
+        gives detections stable track ids. new detections are matched to the tracks by a cost
+        of 1 - iou plus the distance between centers in face widths, so boxes that moved too
+        far to overlap can still be matched. pairs more than max_distance face widths apart
+        are never matched. unmatched detections start new tracks and tracks that go unmatched
+        for more than max_misses updates end.
+
+        every track lives in one of capacity slots for its whole life, so per track state
+        like a KalmanBoxFilter or a BoundingBox can be kept in arrays indexed by slot.
+
+        tracks = TrackManager(5)
+        slots = tracks.update(detected_boxes, identity_ids)
+        for slot in tracks.slots:
+            tracks.track_ids[slot], tracks.ids[slot], tracks.boxes[slot]
+
+        :param capacity: max number of tracks
+        :param max_distance: farthest a track can move between updates in face widths
+        :param max_misses: updates a track can go without a detection before it ends
+        :param hungarian: if True match with the hungarian algorithm, otherwise greedily
+        """
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.hungarian = hungarian
+
+        self.boxes = np.zeros((capacity, 4), dtype='float64')
+        self.track_ids = np.full(capacity, -1, dtype='int64') # -1 is a free slot
+        self.ids = np.full(capacity, -1, dtype='int64') # identity ids
+        self.scores = np.zeros(capacity, dtype='float32')
+        self.hits = np.zeros(capacity, dtype='int64')
+        self.misses = np.zeros(capacity, dtype='int64')
+        self.next_id = 0
+        self.born = np.zeros(0, dtype='int64') # slots started by the last update
+        self.died = np.zeros(0, dtype='int64') # slots ended by the last update
+
+    @property
+    def active(self):
+        return self.track_ids >= 0
+
+    @property
+    def slots(self):
+        return np.flatnonzero(self.active)
+
+    @property
+    def n(self):
+        return int(np.count_nonzero(self.active))
+
+    def cost(self, track_boxes, boxes):
+        """
+        (n tracks, n detections) matching cost, _NO_MATCH where they're too far apart
+        """
+        track_boxes, boxes = vboxes.as_boxes(track_boxes), vboxes.as_boxes(boxes)
+        tc = np.stack(((track_boxes[:, 1] + track_boxes[:, 3]) / 2, (track_boxes[:, 0] + track_boxes[:, 2]) / 2), 1)
+        dc = np.stack(((boxes[:, 1] + boxes[:, 3]) / 2, (boxes[:, 0] + boxes[:, 2]) / 2), 1)
+        width = np.maximum(track_boxes[:, 1] - track_boxes[:, 3], 1)[:, None]
+        distance = np.linalg.norm(tc[:, None, :] - dc[None, :, :], axis=2) / width
+        cost = 1 - vboxes.iou_matrix(track_boxes, boxes) + distance
+        cost[distance > self.max_distance] = self._NO_MATCH
+        return cost
+
+    def update(self, boxes, ids=None, scores=None, track_boxes=None):
+        """
+        :param boxes: (n, 4) detected (t, r, b, l)
+        :param ids: (n,) identity of each detection, -1 if unknown. an unknown detection
+                    doesn't erase the identity of the track it matches
+        :param scores: (n,) match scores
+        :param track_boxes: (capacity, 4) where the tracks are expected to be, i.e. predicted
+                            by a KalmanBoxFilter at the time of the detections. defaults to
+                            the last detected boxes
+        :return: (n,) slot of each detection, -1 if there was no room for it
+        """
+        boxes = vboxes.as_boxes(boxes)
+        n = len(boxes)
+        ids = np.full(n, -1, dtype='int64') if ids is None else np.asarray(ids, dtype='int64')
+        scores = np.zeros(n, dtype='float32') if scores is None else np.asarray(scores, dtype='float32')
+        track_boxes = self.boxes if track_boxes is None else vboxes.as_boxes(track_boxes)
+
+        slots = self.slots
+        assigned = np.full(n, -1, dtype='int64')
+        if len(slots) > 0 and n > 0:
+            cost = self.cost(track_boxes[slots], boxes)
+            if self.hungarian is True:
+                pairs = vboxes.linear_assignment(cost)
+            else:
+                pairs = vboxes.greedy_match(-cost, -self.max_distance - 1)
+            pairs = pairs[cost[pairs[:, 0], pairs[:, 1]] < self._NO_MATCH]
+            assigned[pairs[:, 1]] = slots[pairs[:, 0]]
+
+        # matched tracks
+        matched = assigned >= 0
+        m_slots = assigned[matched]
+        self.boxes[m_slots] = boxes[matched]
+        known = ids[matched] >= 0
+        self.ids[m_slots[known]] = ids[matched][known]
+        self.scores[m_slots[known]] = scores[matched][known]
+        self.hits[m_slots] += 1
+        self.misses[m_slots] = 0
+
+        # tracks nobody matched
+        missed = np.setdiff1d(slots, m_slots)
+        self.misses[missed] += 1
+        self.died = missed[self.misses[missed] > self.max_misses]
+        self.track_ids[self.died] = -1
+
+        # new tracks
+        free = np.flatnonzero(~self.active)
+        new = np.flatnonzero(~matched)[:len(free)]
+        self.born = free[:len(new)]
+        assigned[new] = self.born
+        self.boxes[self.born] = boxes[new]
+        self.ids[self.born] = ids[new]
+        self.scores[self.born] = scores[new]
+        self.hits[self.born] = 1
+        self.misses[self.born] = 0
+        self.track_ids[self.born] = np.arange(self.next_id, self.next_id + len(new))
+        self.next_id += len(new)
+        return assigned